@@ -0,0 +1,167 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+
+def table_version_key(model):
+    return f'table_version:{model._meta.label_lower}'
+
+
+def get_table_version(model):
+    """Текущая версия таблицы из общего кеша.
+
+    Ключ хранится без срока жизни, поэтому версия и построенные на ней
+    ETag меняются только при изменении таблицы. Начальное значение
+    берется из времени, а не с единицы, чтобы после вытеснения ключа из
+    кеша версии не повторялись. Данные под ключами с версией живут
+    TABLE_VERSION_TTL секунд, только чтобы не копить устаревшие записи.
+    """
+    key = table_version_key(model)
+    version = cache.get(key)
+    if version is not None:
+        return version
+    cache.add(key, time_ns(), timeout=None)
+    return cache.get(key)
+
+
+def bump_table_version(sender, **kwargs):
+    """Увеличение версии таблицы, подходит как обработчик сигналов"""
+    key = table_version_key(sender)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time_ns(), timeout=None)
+
+
+def recipe_cache_key(recipe_id):
+    return f'recipe_content:{recipe_id}'
+
+
+def invalidate_recipes(recipe_ids):
+    """Удаление закешированного содержимого рецептов после коммита.
+
+    До коммита другие процессы еще видят старые данные и могут снова
+    положить их в кеш, поэтому ключи удаляются только после него.
+    """
+    keys = [recipe_cache_key(recipe_id) for recipe_id in set(recipe_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def incr_counter(key, delta=1):
+    """Атомарное увеличение счетчика в общем кеше с его созданием"""
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def record_recipe_cache(hits, misses):
+    incr_counter('recipe_cache:hits', hits)
+    incr_counter('recipe_cache:misses', misses)
+
+
+def recipe_cache_stats():
+    """Попадания и промахи кеша рецептов по всем процессам"""
+    counters = cache.get_many(['recipe_cache:hits', 'recipe_cache:misses'])
+    hits = counters.get('recipe_cache:hits', 0)
+    misses = counters.get('recipe_cache:misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+    }
+
+
+class LocalPayloadCache:
+    """Ограниченный по размеру LRU кеш сериализованных ответов процесса"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+payload_cache = LocalPayloadCache(settings.REFERENCE_PAYLOAD_CACHE_SIZE)
+
+
+class ReferenceCacheMixin:
+    """HTTP кеширование справочников (теги, ингредиенты).
+
+    ETag строится из версии таблицы и полного пути запроса, поэтому
+    If-None-Match проверяется до аутентификации и без запросов к БД.
+    Сериализованные ответы хранятся в кеше процесса под тем же ETag.
+    """
+
+    def get_etag(self, request):
+        version = get_table_version(self.queryset.model)
+        digest = hashlib.sha1(
+            f'{version}:{request.get_full_path()}'.encode()
+        ).hexdigest()
+        return f'"{digest}"'
+
+    def patch_caching(self, response):
+        response['ETag'] = self.etag
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.REFERENCE_CACHE_MAX_AGE,
+        )
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        self.etag = None
+        if request.method in ('GET', 'HEAD'):
+            self.etag = self.get_etag(request)
+            if_none_match = parse_etags(
+                request.META.get('HTTP_IF_NONE_MATCH', '')
+            )
+            if self.etag in if_none_match or '*' in if_none_match:
+                return self.patch_caching(HttpResponseNotModified())
+        return super().dispatch(request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """Ответ из кеша процесса или вызов handler с сохранением данных"""
+        data = payload_cache.get(self.etag)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            payload_cache.set(self.etag, data)
+        return self.patch_caching(Response(data))
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -1,23 +1,86 @@
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef
 from django_filters.rest_framework import filters, FilterSet
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 
+from .caching import get_table_version
 
-class IngredientFilter(FilterSet):
-    """Фильтр игредиентов"""
-    name = filters.CharFilter(lookup_expr='istartswith')
+RecipeTag = Recipe.tags.through
+
+TAGS_MODES = (
+    ('any', 'Любой из тегов'),
+    ('all', 'Все теги'),
+)
+ORDERINGS = (
+    ('new', 'Сначала новые'),
+    ('popular', 'Сначала популярные'),
+    ('trending', 'Набирающие популярность'),
+)
+ORDERING_FIELDS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-favorites_count', '-id'),
+    'trending': ('-score__score', '-id'),
+}
+
+
+def get_tag_ids_by_slug():
+    """Словарь slug -> id тегов из кеша, сбрасывается сменой версии Tag"""
+    key = f'tag_ids_by_slug:{get_table_version(Tag)}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, timeout=settings.TABLE_VERSION_TTL)
+    return tag_ids
+
+
+class MultipleValueField(forms.Field):
+    """Поле со списком значений повторяющегося параметра запроса"""
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        return [item for item in value or () if item]
+
+
+class TagSlugsField(MultipleValueField):
+    """Список slug тегов, проверяется по словарю из кеша и отдается id"""
+    default_error_messages = {
+        'invalid_choice': (
+            forms.ModelMultipleChoiceField.default_error_messages[
+                'invalid_choice'
+            ]
+        ),
+    }
+
+    def clean(self, value):
+        slugs = super().clean(value)
+        if not slugs:
+            return []
+        tag_ids_by_slug = get_tag_ids_by_slug()
+        for slug in slugs:
+            if slug not in tag_ids_by_slug:
+                raise forms.ValidationError(
+                    self.error_messages['invalid_choice'],
+                    code='invalid_choice',
+                    params={'value': slug},
+                )
+        return list({tag_ids_by_slug[slug] for slug in slugs})
 
-    class Meta:
-        model = Ingredient
-        fields = ('name', )
+
+class TagSlugsFilter(filters.Filter):
+    """Фильтр по списку slug тегов без запроса к справочнику"""
+    field_class = TagSlugsField
 
 
 class RecipeFilter(FilterSet):
     """Фильтр рецептов"""
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
+    tags = TagSlugsFilter(method='get_tags')
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES,
+        method='get_tags_mode',
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
@@ -25,24 +88,69 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(
+        choices=ORDERINGS,
+        method='get_ordering',
+    )
 
     class Meta:
         model = Recipe
         fields = (
             'author',
             'tags',
+            'tags_mode',
             'is_favorited',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'search',
+            'ordering',
         )
 
+    def get_tags(self, queryset, name, value):
+        """Метод фильтра по тегам, value - id тегов из slug запроса.
+
+        Полусоединение с таблицей тегов рецепта не размножает строки, поэтому
+        DISTINCT не нужен. В режиме tags_mode=all остаются рецепты со всеми
+        тегами, это один GROUP BY/HAVING по таблице тегов рецепта.
+        """
+        if not value:
+            return queryset
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.filter(pk__in=RecipeTag.objects.filter(
+                tag_id__in=value
+            ).values('recipe_id').annotate(
+                tags_count=Count('tag_id')
+            ).filter(tags_count=len(value)).values('recipe_id'))
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe_id=OuterRef('pk'), tag_id__in=value
+        )))
+
+    def get_tags_mode(self, queryset, name, value):
+        """Режим учитывается в фильтре tags"""
+        return queryset
+
     def get_is_favorited(self, queryset, name, value):
         """Метод фильтра есть ли рецепт в избранном"""
         if self.request.user.is_authenticated and value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         """Метод фильтра есть ли рецепт в списке покупок"""
         if self.request.user.is_authenticated and value:
-            return queryset.filter(shoppinglist_recipe__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        """Полнотекстовый поиск, без ordering - по релевантности"""
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        """Метод сортировки: новые, популярные или набирающие популярность.
+
+        trending идет по предрассчитанной таблице RecipeScore (индекс по
+        убыванию популярности), рецепты попадают в нее при пересчете.
+        """
+        if value == 'trending':
+            queryset = queryset.filter(score__isnull=False)
+        return queryset.order_by(*ORDERING_FIELDS[value])
@@ -1,6 +1,244 @@
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .caching import get_table_version
+
+
+def explain_plan(queryset):
+    """Корневой узел плана EXPLAIN (FORMAT JSON) запроса в PostgreSQL.
+
+    psycopg2 сам разбирает колонку типа json, поэтому результат
+    QuerySet.explain(format='json') не годится для json.loads.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
 
 
 class CustomPageNumberPagination(pagination.PageNumberPagination):
     """Класс кастомной пагинации"""
     page_size_query_param = 'limit'
+
+
+class FixedCountPaginator(Paginator):
+    """Paginator с заранее известным количеством объектов"""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
+
+
+class CachedCountPagination(CustomPageNumberPagination):
+    """Пагинация с кешированием количества объектов.
+
+    Точное количество кешируется на RECIPE_COUNT_CACHE_TTL секунд по
+    нормализованному набору фильтров и версии таблицы, которая меняется
+    при создании, удалении и смене тегов рецептов. Фильтры по избранному и
+    списку покупок зависят от пользователя и считаются без кеша. Для
+    анонимных запросов на PostgreSQL, если оценка планировщика больше
+    RECIPE_COUNT_ESTIMATE_THRESHOLD, используется она, а в ответе
+    count_is_approximate равен true.
+    """
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_is_approximate = False
+        count = self.get_count(queryset, request)
+        self.django_paginator_class = (
+            lambda object_list, per_page, **kwargs: FixedCountPaginator(
+                object_list, per_page, count, **kwargs
+            )
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_cache_key(self, queryset, request):
+        params = sorted(
+            (key, sorted(request.query_params.getlist(key)))
+            for key in request.query_params
+            if key not in (self.page_query_param, self.page_size_query_param)
+        )
+        digest = hashlib.sha1(json.dumps(params).encode()).hexdigest()
+        version = get_table_version(queryset.model)
+        return f'count:{queryset.model._meta.label_lower}:{version}:{digest}'
+
+    def get_count(self, queryset, request):
+        if any(
+            request.query_params.get(key) not in (None, '', '0', 'false')
+            for key in self.user_filters
+        ):
+            return queryset.count()
+        key = self.get_cache_key(queryset, request)
+        cached = cache.get(key)
+        if cached is None:
+            cached = self.estimate_count(queryset, request)
+            if cached is None:
+                cached = (queryset.count(), False)
+            cache.set(key, cached, settings.RECIPE_COUNT_CACHE_TTL)
+        count, self.count_is_approximate = cached
+        return count
+
+    @staticmethod
+    def estimate_count(queryset, request):
+        """Оценка планировщика PostgreSQL для анонимных запросов"""
+        if connection.vendor != 'postgresql' or request.user.is_authenticated:
+            return None
+        plan = explain_plan(queryset.order_by().values('pk'))
+        estimate = int(plan['Plan Rows'])
+        if estimate <= settings.RECIPE_COUNT_ESTIMATE_THRESHOLD:
+            return None
+        return estimate, True
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_is_approximate'] = self.count_is_approximate
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_approximate'] = {
+            'type': 'boolean',
+        }
+        return response_schema
+
+
+class RecipeCursorPagination(pagination.BasePagination):
+    """Keyset пагинация ленты рецептов по (pub_date, id).
+
+    Страница выбирается условием по ключу последней записи вместо OFFSET,
+    COUNT не выполняется, поэтому время ответа не зависит от глубины.
+    Курсор непрозрачен для клиента: base64 от json с ключом и направлением.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.prepare(request)
+        return self.paginate_results(list(self.seek(queryset)))
+
+    def prepare(self, request):
+        """Размер страницы и курсор из параметров запроса"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = remove_query_param(
+            request.build_absolute_uri(), 'page'
+        )
+        self.cursor = self.decode_cursor(request)
+        self.reverse = self.cursor is not None and self.cursor[2]
+
+    def seek(self, queryset, id_field='id'):
+        """queryset по ключу (pub_date, id_field) после курсора.
+
+        Возвращает не больше page_size + 1 записей, при переходе назад -
+        в обратном порядке.
+        """
+        queryset = queryset.order_by('-pub_date', f'-{id_field}')
+        if self.cursor is not None:
+            pub_date, pk, reverse = self.cursor
+            if reverse:
+                queryset = queryset.filter(pub_date__gte=pub_date).filter(
+                    Q(pub_date__gt=pub_date) | Q(**{f'{id_field}__gt': pk})
+                ).reverse()
+            else:
+                queryset = queryset.filter(pub_date__lte=pub_date).filter(
+                    Q(pub_date__lt=pub_date) | Q(**{f'{id_field}__lt': pk})
+                )
+        return queryset[:self.page_size + 1]
+
+    def paginate_results(self, results):
+        """Страница из записей в порядке seek.
+
+        Лишняя запись означает, что есть следующая страница, а при
+        переходе назад - предыдущая.
+        """
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = self.cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return pagination._positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            pub_date, pk, reverse = json.loads(
+                urlsafe_b64decode(encoded.encode('ascii'))
+            )
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (BinasciiError, TypeError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk, bool(reverse)
+
+    def encode_cursor(self, recipe, reverse):
+        encoded = urlsafe_b64encode(json.dumps(
+            [recipe.pub_date.isoformat(), recipe.id, int(reverse)]
+        ).encode('ascii')).decode('ascii')
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,91 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.datastructures import MultiValueDict
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import DataAndFiles, JSONParser, MultiPartParser
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой запрос'
+    default_code = 'payload_too_large'
+
+
+class ContentLengthLimitMixin:
+    """Отказ по заголовку Content-Length до чтения тела запроса"""
+
+    def get_max_content_length(self):
+        raise NotImplementedError
+
+    def check_content_length(self, parser_context):
+        request = parser_context['request']
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > self.get_max_content_length():
+            raise PayloadTooLarge()
+
+
+class LimitedJSONParser(ContentLengthLimitMixin, JSONParser):
+    """JSON с фото в Base64, которое на треть больше самого файла"""
+
+    def get_max_content_length(self):
+        return (
+            settings.RECIPE_IMAGE_MAX_SIZE * 4 // 3
+            + settings.RECIPE_FORM_MAX_SIZE
+        )
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        self.check_content_length(parser_context)
+        return super().parse(stream, media_type, parser_context)
+
+
+class FormData(dict):
+    """Поля из JSON части data, к которым DRF добавляет файлы формы.
+
+    dict.update с MultiValueDict копирует его внутренние списки, поэтому
+    файлы добавляются по одному значению на поле.
+    """
+
+    def copy(self):
+        return FormData(self)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, MultiValueDict):
+            other = other.items()
+        super().update(other, **kwargs)
+
+
+class StreamingMultiPartParser(ContentLengthLimitMixin, MultiPartParser):
+    """multipart/form-data с фото, которое пишется во временный файл.
+
+    Файл не держится в памяти целиком, он читается частями прямо на диск.
+    Поля рецепта передаются JSON строкой в части data (вложенные tags и
+    ingredients), либо обычными полями формы. Файлы остаются в
+    request.FILES, чтобы Django закрыл и удалил временные файлы в конце
+    запроса.
+    """
+
+    def get_max_content_length(self):
+        return settings.RECIPE_IMAGE_MAX_SIZE + settings.RECIPE_FORM_MAX_SIZE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        self.check_content_length(parser_context)
+        request = parser_context['request']
+        request.upload_handlers = [
+            TemporaryFileUploadHandler(request._request)
+        ]
+        parsed = super().parse(stream, media_type, parser_context)
+        if 'data' not in parsed.data:
+            return parsed
+        try:
+            data = json.loads(parsed.data['data'])
+        except ValueError as error:
+            raise ParseError(f'Некорректный JSON в части data: {error}')
+        if not isinstance(data, dict):
+            raise ParseError('Часть data должна быть JSON объектом')
+        return DataAndFiles(FormData(data), parsed.files)
@@ -0,0 +1,87 @@
+from django.db import connection
+from django.utils import timezone
+
+
+def get_field(model, name):
+    """Поле модели по имени, pk - первичный ключ"""
+    if name == 'pk':
+        return model._meta.pk
+    return model._meta.get_field(name)
+
+
+def insert_or_ignore(model, rows, returning='pk'):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING одним запросом.
+
+    rows - словари {поле: значение} с одинаковым набором полей.
+    Возвращает значения поля returning только для вставленных строк:
+    строки, которые уже есть по уникальному ограничению, в том числе
+    вставленные параллельным запросом, в результат не попадают. Поля
+    auto_now_add заполняются текущим временем. Нарушение внешнего ключа
+    не подавляется: IntegrityError возникает сразу или при коммите, если
+    ограничение отложенное.
+    """
+    if not rows:
+        return []
+    now = timezone.now()
+    names = list(rows[0])
+    names.extend(
+        field.attname for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now_add', False) and field.attname not in names
+    )
+    fields = [model._meta.get_field(name) for name in names]
+    quote = connection.ops.quote_name
+    placeholders = f'({", ".join(["%s"] * len(fields))})'
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} '
+        f'({", ".join(quote(field.column) for field in fields)}) '
+        f'VALUES {", ".join([placeholders] * len(rows))} '
+        f'ON CONFLICT DO NOTHING '
+        f'RETURNING {quote(get_field(model, returning).column)}'
+    )
+    params = [
+        field.get_db_prep_save(
+            row[name] if name in row else now, connection
+        )
+        for row in rows
+        for name, field in zip(names, fields)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_returning(model, returning='pk', **filters):
+    """DELETE ... RETURNING одним запросом.
+
+    Фильтры - равенство поля или поле__in со списком значений.
+    Возвращает значения поля returning удаленных строк. Сигналы и
+    каскады Django не выполняются, поэтому подходит только для моделей,
+    на которые нет ссылок, например связей пользователя с рецептами и
+    авторами.
+    """
+    conditions = []
+    params = []
+    quote = connection.ops.quote_name
+    for name, value in filters.items():
+        name, _, lookup = name.partition('__')
+        field = model._meta.get_field(name)
+        if lookup == 'in':
+            if not value:
+                return []
+            conditions.append(
+                f'{quote(field.column)} IN ({", ".join(["%s"] * len(value))})'
+            )
+            params.extend(
+                field.get_db_prep_value(item, connection) for item in value
+            )
+        else:
+            conditions.append(f'{quote(field.column)} = %s')
+            params.append(field.get_db_prep_value(value, connection))
+    sql = (
+        f'DELETE FROM {quote(model._meta.db_table)} '
+        f'WHERE {" AND ".join(conditions)} '
+        f'RETURNING {quote(get_field(model, returning).column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,125 @@
+import csv
+from io import BytesIO
+from itertools import chain
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+SHOPPING_CART_TITLE = 'Список покупок:'
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """Базовый рендерер выгрузки списка покупок.
+
+    Список покупок отдается потоково через stream(), который получает
+    итератор кортежей (название, единица измерения, количество).
+    render() нужен DRF для служебных ответов эндпоинта, например ошибок.
+    """
+    charset = 'utf-8'
+
+    def stream(self, ingredients):
+        """Генератор частей файла со списком покупок"""
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            lines = [f'{key}: {value}' for key, value in data.items()]
+        else:
+            lines = [str(data)]
+        return self.render_lines(lines)
+
+    def render_lines(self, lines):
+        """Рендеринг произвольных строк текста"""
+        return '\n'.join(lines).encode(self.charset)
+
+
+class TxtShoppingCartRenderer(ShoppingCartRenderer):
+    """Выгрузка списка покупок в формате txt"""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield f'{SHOPPING_CART_TITLE}\n'.encode(self.charset)
+        for name, unit, amount in ingredients:
+            yield f'\n{name} - {amount}, {unit}'.encode(self.charset)
+
+
+class Echo:
+    """Псевдобуфер: csv.writer возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+class CsvShoppingCartRenderer(ShoppingCartRenderer):
+    """Выгрузка списка покупок в формате csv"""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield '\ufeff'.encode(self.charset)
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        ).encode(self.charset)
+        for name, unit, amount in ingredients:
+            yield writer.writerow((name, amount, unit)).encode(self.charset)
+
+
+class PdfShoppingCartRenderer(ShoppingCartRenderer):
+    """Выгрузка списка покупок в формате pdf.
+
+    Строк в списке не больше, чем ингредиентов в справочнике, поэтому
+    документ собирается целиком и отдается частями.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    chunk_size = 64 * 1024
+
+    def stream(self, ingredients):
+        content = self.render_lines(chain(
+            (SHOPPING_CART_TITLE, ''),
+            (
+                f'{name} - {amount}, {unit}'
+                for name, unit, amount in ingredients
+            )
+        ))
+        for start in range(0, len(content), self.chunk_size):
+            yield content[start:start + self.chunk_size]
+
+    def render_lines(self, lines):
+        """Рендеринг строк текста в документ pdf.
+
+        Постранично не стримится: reportlab держит все страницы в памяти
+        до save(), поэтому первый байт уходит клиенту только после
+        последней строки, а память растет с числом строк.
+        """
+        if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(PDF_FONT_NAME, settings.PDF_FONT_PATH)
+            )
+        buffer = BytesIO()
+        document = canvas.Canvas(buffer, pagesize=A4)
+        height = A4[1]
+        document.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+        y = height - PDF_MARGIN
+        for line in lines:
+            if y < PDF_MARGIN:
+                document.showPage()
+                document.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            document.drawString(PDF_MARGIN, y, line)
+            y -= PDF_LINE_HEIGHT
+        document.save()
+        return buffer.getvalue()
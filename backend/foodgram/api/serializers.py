@@ -1,23 +1,52 @@
+from collections import OrderedDict
+from uuid import uuid4
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
 from django.db import transaction
+from django.db.models import prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
+from PIL import Image, UnidentifiedImageError
 from rest_framework import serializers
 
+from recipes.feed import schedule_fan_out
+from recipes.images import schedule_variants, variant_path
+from recipes.matching import recipe_matcher
 from recipes.models import (
     Favorite,
     Ingredient,
     Recipe,
     RecipeIngredient,
+    ShoppingCartItem,
     ShoppingList,
     Tag
 )
-from users.models import Follow
+from users.models import change_counters, Follow
 
+from .caching import invalidate_recipes, recipe_cache_key, record_recipe_cache
 from .validators import validate_cooking_time, validate_count
 
 User = get_user_model()
 
+RECIPE_FIELDS = (
+    'id',
+    'tags',
+    'ingredients',
+    'author',
+    'name',
+    'image',
+    'image_variants',
+    'text',
+    'cooking_time',
+    'is_favorited',
+    'is_in_shopping_cart',
+    'favorites_count',
+    'shopping_carts_count',
+)
+
 
 class CustomUserSerializer(serializers.ModelSerializer):
     """Сериализатор кастомной модели User"""
@@ -31,24 +60,128 @@ class CustomUserSerializer(serializers.ModelSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
+            'recipes_count',
+            'followers_count',
+            'following_count',
+        )
+        read_only_fields = (
+            'recipes_count',
+            'followers_count',
+            'following_count',
         )
         model = User
 
+    def get_followed_ids(self):
+        """Множество id авторов, на которых подписан текущий пользователь.
+
+        Загружается одним запросом и кешируется в контексте, общем для
+        вложенных сериализаторов и элементов списка.
+        """
+        if 'followed_ids' not in self.context:
+            self.context['followed_ids'] = set(
+                Follow.objects.filter(
+                    user=self.context['request'].user
+                ).values_list('author_id', flat=True)
+            )
+        return self.context['followed_ids']
+
     def get_is_subscribed(self, obj):
         """Метод проверки наличия подписки на пользователя"""
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
-        return Follow.objects.filter(
-            user=request.user,
-            author=obj
-        ).exists()
+        return obj.id in self.get_followed_ids()
+
+
+def media_url(path, request):
+    """Абсолютная ссылка на файл хранилища"""
+    url = default_storage.url(path)
+    if request is None:
+        return url
+    return request.build_absolute_uri(url)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии фото {вариант: {формат: url}}"""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return {
+            variant: {
+                extension: media_url(path, request)
+                for extension, path in formats.items()
+            }
+            for variant, formats in value.items()
+        }
+
+
+class CardImageField(serializers.ReadOnlyField):
+    """Ссылка на карточку (card) фото рецепта, пока ее нет - на оригинал"""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        path = variant_path(value, 'card')
+        if path is None:
+            return None
+        return media_url(path, self.context.get('request'))
+
+
+class RecipeImageField(Base64ImageField):
+    """Фото рецепта строкой Base64 или файлом из multipart/form-data.
+
+    Размер проверяется до декодирования Base64, размеры и формат файла из
+    формы - только по заголовку изображения, без полного декодирования.
+    """
+    image_formats = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return self.check_upload(data)
+        if isinstance(data, str):
+            self.check_size(len(data.split(';base64,')[-1]) * 3 // 4)
+        image = super().to_internal_value(data)
+        if image is not None:
+            self.check_dimensions(image.image.size)
+        return image
+
+    def check_size(self, size):
+        if size > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Размер фото больше '
+                f'{settings.RECIPE_IMAGE_MAX_SIZE // 1024 // 1024} МБ'
+            )
+
+    def check_dimensions(self, size):
+        if max(size) > settings.RECIPE_IMAGE_MAX_SIDE:
+            raise serializers.ValidationError(
+                f'Сторона фото больше {settings.RECIPE_IMAGE_MAX_SIDE} px'
+            )
+
+    def check_upload(self, file):
+        self.check_size(file.size)
+        try:
+            with Image.open(file) as image:
+                image_format = image.format
+                self.check_dimensions(image.size)
+        except (UnidentifiedImageError, OSError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        if image_format not in self.image_formats:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        file.seek(0)
+        file.name = f'{uuid4()}.{image_format.lower()}'
+        return file
 
 
 class BreifRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор рецепта с кратким набором полей"""
+    image = CardImageField()
+    image_variants = ImageVariantsField()
+
     class Meta:
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         model = Recipe
 
 
@@ -58,18 +191,17 @@ class FollowingSerializer(serializers.ModelSerializer):
     recipes = BreifRecipeSerializer(
         many=True,
         read_only=True,
-        source='author.recipe_author'
+        source='author.limited_recipes'
+    )
+    recipes_count = serializers.IntegerField(
+        read_only=True,
+        source='author.recipes_count'
     )
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Follow
         fields = ('author', 'recipes', 'recipes_count', 'user')
 
-    def get_recipes_count(self, obj):
-        """Метод возвращает кол-во рецептов автора"""
-        return obj.author.recipe_author.count()
-
     def to_representation(self, instance):
         """Метод представления результатов сериализатора"""
         representation = super().to_representation(instance)
@@ -124,10 +256,49 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         model = RecipeIngredient
 
 
+class BulkRecipesSerializer(serializers.Serializer):
+    """Сериализатор пакетного добавления и удаления рецептов по id"""
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=settings.BULK_RECIPES_MAX_SIZE,
+        default=list,
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=settings.BULK_RECIPES_MAX_SIZE,
+        default=list,
+    )
+
+    def validate(self, data):
+        """Повторы id убираются, один id нельзя и добавить, и удалить"""
+        add = list(dict.fromkeys(data['add']))
+        remove = list(dict.fromkeys(data['remove']))
+        if not add and not remove:
+            raise serializers.ValidationError(
+                'Передайте хотя бы один рецепт в add или remove'
+            )
+        both = set(add) & set(remove)
+        if both:
+            raise serializers.ValidationError(
+                f'Рецепты {sorted(both)} переданы и в add, и в remove'
+            )
+        return {'add': add, 'remove': remove}
+
+
+class RecipeMatchSerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.RECIPE_MATCH_MAX_INGREDIENTS,
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
 class MainRecipeSerializer(serializers.ModelSerializer):
     """Cериализатор рецептов"""
     author = CustomUserSerializer(read_only=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True,
@@ -159,7 +330,7 @@ class MainRecipeSerializer(serializers.ModelSerializer):
         """Метод для добавления ингредиентов"""
         RecipeIngredient.objects.bulk_create(
             [RecipeIngredient(
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 recipe=recipe,
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
@@ -171,20 +342,105 @@ class MainRecipeSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data, author=current_user)
+        change_counters(
+            User.objects.filter(pk=current_user.pk), recipes_count=1
+        )
+        current_user.refresh_from_db(fields=['recipes_count'])
         self.create_ingredients(recipe=recipe, ingredients=ingredients)
         recipe.tags.set(tags)
+        recipe_matcher.mark_dirty([recipe.pk])
+        schedule_fan_out(recipe)
+        schedule_variants(recipe)
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Метод приведения ингредиентов рецепта к переданному набору.
+
+        Существующие строки сравниваются с новыми, выполняются только
+        необходимые bulk_create, bulk_update и delete.
+        """
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        old_amounts = {}
+        kept = set()
+        to_update = []
+        to_delete = []
+        for recipe_ingredient in recipe.recipe_ingredients.all():
+            ingredient_id = recipe_ingredient.ingredient_id
+            old_amounts[ingredient_id] = (
+                old_amounts.get(ingredient_id, 0) + recipe_ingredient.amount
+            )
+            if ingredient_id not in amounts or ingredient_id in kept:
+                to_delete.append(recipe_ingredient.id)
+                continue
+            kept.add(ingredient_id)
+            if recipe_ingredient.amount != amounts[ingredient_id]:
+                recipe_ingredient.amount = amounts[ingredient_id]
+                to_update.append(recipe_ingredient)
+        if to_delete:
+            RecipeIngredient.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        to_create = [
+            {'id': ingredient_id, 'amount': amount}
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in kept
+        ]
+        if to_create:
+            MainRecipeSerializer.create_ingredients(recipe, to_create)
+        ShoppingCartItem.objects.change_recipe(recipe, {
+            ingredient_id: (
+                amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | amounts.keys()
+        })
+
+    @staticmethod
+    def save_image(recipe, image):
+        """Сохранение загруженного фото, возвращает имя в хранилище.
+
+        Загрузка приходит со случайным именем, а хранилище сохраняет файл
+        под хешем содержимого, поэтому то же самое фото получает прежнее
+        имя и сравнивается с текущим уже после сохранения.
+        """
+        field = recipe.image.field
+        return field.storage.save(
+            field.generate_filename(recipe, image.name),
+            image,
+            max_length=field.max_length,
+        )
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        instance = super().update(instance, validated_data)
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients(recipe=instance, ingredients=ingredients)
-        instance.save()
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if validated_data.get('image'):
+            validated_data['image'] = self.save_image(
+                instance, validated_data['image']
+            )
+        changed_fields = [
+            field for field, value in validated_data.items()
+            if getattr(instance, field) != value
+        ]
+        for field in changed_fields:
+            setattr(instance, field, validated_data[field])
+        if 'image' in changed_fields:
+            instance.image_variants = {}
+            changed_fields.append('image_variants')
+        if changed_fields:
+            instance.save(update_fields=changed_fields)
+        if 'image' in changed_fields:
+            schedule_variants(instance)
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
+            recipe_matcher.mark_dirty([instance.pk])
+        invalidate_recipes([instance.pk])
         return instance
 
     def to_representation(self, instance):
@@ -200,12 +456,30 @@ class MainRecipeSerializer(serializers.ModelSerializer):
         return value
 
     def validate_ingredients(self, value):
-        """Метод валидации кол-ва игредиентов в рецепте"""
+        """Метод валидации кол-ва, существования и повторов игредиентов"""
         if not value or len(value) < settings.MIN_INGREDIENTS_QTY:
             raise serializers.ValidationError(
                 f'Рецепт должен содержать хотя бы '
                 f'{settings.MIN_INGREDIENTS_QTY} ингредиент!'
             )
+        ingredient_ids = [ingredient['id'] for ingredient in value]
+        existing = Ingredient.objects.only('id').in_bulk(ingredient_ids)
+        errors = []
+        seen = set()
+        for ingredient_id in ingredient_ids:
+            if ingredient_id not in existing:
+                errors.append({'id': [
+                    f'Ингредиента с id={ingredient_id} не существует'
+                ]})
+            elif ingredient_id in seen:
+                errors.append({'id': [
+                    f'Ингредиент с id={ingredient_id} указан повторно'
+                ]})
+            else:
+                errors.append({})
+            seen.add(ingredient_id)
+        if any(errors):
+            raise serializers.ValidationError(errors)
         return value
 
     def validate_tags(self, value):
@@ -218,8 +492,8 @@ class MainRecipeSerializer(serializers.ModelSerializer):
         return value
 
 
-class ReadRecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор списка рецептов"""
+class RecipeContentSerializer(serializers.ModelSerializer):
+    """Не зависящая от пользователя часть рецепта, хранится в общем кеше"""
 
     ingredients = IngredientsInRecipeSerializer(
         source='recipe_ingredients',
@@ -227,42 +501,120 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
         read_only=True,
     )
     tags = TagSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'tags', 'ingredients', 'name', 'text', 'cooking_time')
+        read_only_fields = fields
+
+
+def get_recipe_contents(recipes):
+    """Содержимое рецептов из кеша по id, недостающее сериализуется.
+
+    Теги и ингредиенты подгружаются только для промахов. Внутри
+    транзакции кеш не пополняется: данные могут быть откачены.
+    """
+    keys = {recipe_cache_key(recipe.pk): recipe for recipe in recipes}
+    cached = cache.get_many(keys)
+    contents = {
+        recipe.pk: cached[key]
+        for key, recipe in keys.items() if key in cached
+    }
+    missing = [recipe for recipe in keys.values() if recipe.pk not in contents]
+    if missing:
+        prefetch_related_objects(
+            missing, 'tags', 'recipe_ingredients__ingredient'
+        )
+        fresh = {
+            recipe.pk: dict(RecipeContentSerializer(recipe).data)
+            for recipe in missing
+        }
+        contents.update(fresh)
+        if not transaction.get_connection().in_atomic_block:
+            cache.set_many(
+                {recipe_cache_key(pk): data for pk, data in fresh.items()},
+                timeout=settings.RECIPE_CACHE_TTL,
+            )
+    record_recipe_cache(hits=len(cached), misses=len(missing))
+    return contents
+
+
+class ReadRecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов с чтением содержимого из кеша одним запросом"""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        self.child.contents = get_recipe_contents(recipes)
+        return super().to_representation(recipes)
+
+
+class ReadRecipeSerializer(serializers.ModelSerializer):
+    """Сериализатор списка рецептов.
+
+    Теги, ингредиенты и текст берутся из общего кеша, автор, фото,
+    счетчики и флаги текущего пользователя добавляются при каждом запросе.
+    В image отдается оригинал фото, уменьшенные копии - в image_variants.
+    """
+
     author = CustomUserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_variants = ImageVariantsField()
 
-    def get_is_favorited(self, obj):
-        """Имеется ли рецепт в избранном"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.contents = {}
+
+    def _get_user_flag(self, obj, flag, model):
+        """Флаг из аннотации queryset, иначе отдельный запрос"""
+        if hasattr(obj, flag):
+            return getattr(obj, flag)
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
-        return Favorite.objects.filter(
+        return model.objects.filter(
             user=request.user,
             recipe=obj.id
         ).exists()
 
+    def get_is_favorited(self, obj):
+        """Имеется ли рецепт в избранном"""
+        return self._get_user_flag(obj, 'is_favorited', Favorite)
+
     def get_is_in_shopping_cart(self, obj):
         """Имеется ли рецепт в списке покупок"""
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
-            return False
-        return ShoppingList.objects.filter(
-            user=request.user,
-            recipe=obj.id
-        ).exists()
+        return self._get_user_flag(obj, 'is_in_shopping_cart', ShoppingList)
+
+    def to_representation(self, instance):
+        content = self.contents.get(instance.pk)
+        if content is None:
+            content = get_recipe_contents([instance])[instance.pk]
+        representation = super().to_representation(instance)
+        return OrderedDict(
+            (field, content.get(field, representation.get(field)))
+            for field in RECIPE_FIELDS
+        )
 
     class Meta:
         model = Recipe
         fields = (
-            'id',
-            'tags',
-            'ingredients',
             'author',
-            'name',
             'image',
-            'text',
-            'cooking_time',
+            'image_variants',
             'is_favorited',
             'is_in_shopping_cart',
+            'favorites_count',
+            'shopping_carts_count',
         )
         read_only_fields = fields
+        list_serializer_class = ReadRecipeListSerializer
+
+
+class MatchedRecipeSerializer(ReadRecipeSerializer):
+    """Рецепт из подбора по ингредиентам с числом найденных и недостающих"""
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['matched_count'] = instance.matched_count
+        representation['missing_count'] = instance.missing_count
+        return representation
@@ -0,0 +1,113 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete
+)
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+
+from .caching import bump_table_version, invalidate_recipes
+
+for model in (Ingredient, Recipe, Tag):
+    post_save.connect(
+        bump_table_version,
+        sender=model,
+        dispatch_uid=f'{model._meta.label_lower}_version_save',
+    )
+    post_delete.connect(
+        bump_table_version,
+        sender=model,
+        dispatch_uid=f'{model._meta.label_lower}_version_delete',
+    )
+
+
+def bump_recipe_version(sender, **kwargs):
+    """Смена тегов меняет результаты фильтров и количество рецептов"""
+    if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        bump_table_version(Recipe)
+
+
+m2m_changed.connect(
+    bump_recipe_version,
+    sender=Recipe.tags.through,
+    dispatch_uid='recipe_tags_version',
+)
+
+
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    invalidate_recipes([instance.recipe_id])
+
+
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменение тегов со стороны рецепта или со стороны тега"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_recipes([instance.pk])
+    elif action == 'pre_clear':
+        tag_changed(sender, instance)
+    else:
+        invalidate_recipes(pk_set)
+
+
+def tag_changed(sender, instance, **kwargs):
+    """Рецепты с измененным тегом.
+
+    Для удаления используется pre_delete: после удаления связи с
+    рецептами уже не найти.
+    """
+    if not kwargs.get('created'):
+        invalidate_recipes(
+            Recipe.tags.through.objects.filter(
+                tag_id=instance.pk
+            ).values_list('recipe_id', flat=True)
+        )
+
+
+def ingredient_changed(sender, instance, **kwargs):
+    """Рецепты с измененным ингредиентом, pre_delete как для тегов"""
+    if not kwargs.get('created'):
+        invalidate_recipes(
+            RecipeIngredient.objects.filter(
+                ingredient_id=instance.pk
+            ).values_list('recipe_id', flat=True)
+        )
+
+
+post_save.connect(
+    recipe_changed, sender=Recipe, dispatch_uid='recipe_content_save'
+)
+post_delete.connect(
+    recipe_changed, sender=Recipe, dispatch_uid='recipe_content_delete'
+)
+post_save.connect(
+    recipe_ingredient_changed,
+    sender=RecipeIngredient,
+    dispatch_uid='recipe_ingredient_content_save',
+)
+post_delete.connect(
+    recipe_ingredient_changed,
+    sender=RecipeIngredient,
+    dispatch_uid='recipe_ingredient_content_delete',
+)
+m2m_changed.connect(
+    recipe_tags_changed,
+    sender=Recipe.tags.through,
+    dispatch_uid='recipe_tags_content',
+)
+for model, handler in ((Tag, tag_changed), (Ingredient, ingredient_changed)):
+    post_save.connect(
+        handler,
+        sender=model,
+        dispatch_uid=f'{model._meta.label_lower}_content_save',
+    )
+    pre_delete.connect(
+        handler,
+        sender=model,
+        dispatch_uid=f'{model._meta.label_lower}_content_delete',
+    )
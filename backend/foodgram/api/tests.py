@@ -0,0 +1,594 @@
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from threading import Barrier
+from unittest import SkipTest
+
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase
+
+from recipes.fixtures import seed_ingredients, seed_recipes, seed_users
+from recipes.models import (
+    Favorite,
+    MediaFile,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCartItem,
+    ShoppingList,
+    Tag
+)
+from users.models import Follow, User
+
+
+class RecipeQueriesTest(APITestCase):
+    """Число запросов списка и рецепта не зависит от размера страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author_ids = seed_users(3, 'author')
+        cls.user = User.objects.get(pk=seed_users(1, 'reader')[0])
+        recipe_ids = seed_recipes(
+            author_ids, 120, seed_ingredients(10), per_recipe=3
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'tag {number}',
+                color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(3)
+        ]
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe_id, tag=tag)
+            for recipe_id in recipe_ids
+            for tag in tags[:recipe_id % 3 + 1]
+        ])
+        Favorite.objects.bulk_create([
+            Favorite(user=cls.user, recipe_id=recipe_id)
+            for recipe_id in recipe_ids[::2]
+        ])
+        ShoppingList.objects.bulk_create([
+            ShoppingList(user=cls.user, recipe_id=recipe_id)
+            for recipe_id in recipe_ids[::3]
+        ])
+        Follow.objects.create(user=cls.user, author_id=author_ids[0])
+        cls.recipe_id = recipe_ids[-1]
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_list_queries(self, queries):
+        for limit in (6, 100):
+            cache.clear()
+            with self.subTest(limit=limit), self.assertNumQueries(queries):
+                response = self.client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous_list(self):
+        # На PostgreSQL число рецептов сначала оценивается через EXPLAIN
+        self.assert_list_queries(
+            6 if connection.vendor == 'postgresql' else 5
+        )
+
+    def test_authenticated_list(self):
+        self.client.force_authenticate(self.user)
+        self.assert_list_queries(6)
+        response = self.client.get('/api/recipes/?limit=100')
+        flags = {
+            recipe['id']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart']
+            )
+            for recipe in response.data['results']
+        }
+        favorited = set(Favorite.objects.filter(
+            user=self.user
+        ).values_list('recipe_id', flat=True))
+        in_cart = set(ShoppingList.objects.filter(
+            user=self.user
+        ).values_list('recipe_id', flat=True))
+        self.assertEqual(flags, {
+            recipe_id: (recipe_id in favorited, recipe_id in in_cart)
+            for recipe_id in flags
+        })
+
+    def test_detail(self):
+        url = f'/api/recipes/{self.recipe_id}/'
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        self.client.force_authenticate(self.user)
+        cache.clear()
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['ingredients']), 3)
+
+
+class RecipeCreateTest(APITestCase):
+    """Ингредиенты рецепта проверяются и создаются пакетно"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.get(pk=seed_users(1, 'chef')[0])
+        cls.ingredient_ids = seed_ingredients(20)
+        cls.tag = Tag.objects.create(
+            name='Ужин', color='#8775D2', slug='dinner'
+        )
+
+    def setUp(self):
+        media_root = TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.client.force_authenticate(self.author)
+
+    def create(self, ingredients):
+        buffer = BytesIO()
+        Image.new('RGB', (32, 32), 'red').save(buffer, 'PNG')
+        encoded = b64encode(buffer.getvalue()).decode('ascii')
+        return self.client.post('/api/recipes/', {
+            'tags': [self.tag.id],
+            'ingredients': ingredients,
+            'image': f'data:image/png;base64,{encoded}',
+            'name': 'Рагу',
+            'text': 'Тушить час',
+            'cooking_time': 60,
+        }, format='json')
+
+    def test_queries(self):
+        queries = []
+        for count in (3, 20):
+            with CaptureQueriesContext(connection) as context:
+                response = self.create([
+                    {'id': ingredient_id, 'amount': 10}
+                    for ingredient_id in self.ingredient_ids[:count]
+                ])
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(
+                RecipeIngredient.objects.filter(
+                    recipe_id=response.data['id']
+                ).count(),
+                count,
+            )
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_invalid_ingredients(self):
+        first, second = self.ingredient_ids[:2]
+        response = self.create([
+            {'id': first, 'amount': 1},
+            {'id': 999999, 'amount': 1},
+            {'id': second, 'amount': 1},
+            {'id': first, 'amount': 2},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['ingredients']
+        self.assertEqual(len(errors), 4)
+        self.assertFalse(errors[0] or errors[2])
+        self.assertIn('id', errors[1])
+        self.assertIn('id', errors[3])
+        self.assertFalse(Recipe.objects.filter(author=self.author).exists())
+
+
+class RecipeUpdateTest(APITestCase):
+    """Изменение рецепта пишет в БД только разницу"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author_id, buyer_id = seed_users(2, 'editor')
+        cls.author = User.objects.get(pk=author_id)
+        cls.ingredient_ids = seed_ingredients(4)
+        cls.recipe_id = seed_recipes(
+            [author_id], 1, cls.ingredient_ids[:3], per_recipe=3
+        )[0]
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#49B64E', slug='lunch'
+        )
+        recipe = Recipe.objects.get(pk=cls.recipe_id)
+        recipe.tags.set([cls.tag])
+        cls.buyer = User.objects.get(pk=buyer_id)
+        ShoppingList.objects.create(user=cls.buyer, recipe=recipe)
+        ShoppingCartItem.objects.add_recipe(cls.buyer, recipe)
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe_id}/'
+
+    def rows(self):
+        return {
+            ingredient_id: (row_id, amount)
+            for row_id, ingredient_id, amount
+            in RecipeIngredient.objects.filter(
+                recipe_id=self.recipe_id
+            ).values_list('id', 'ingredient_id', 'amount')
+        }
+
+    def patch(self, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].lstrip().upper().startswith(
+                ('INSERT', 'UPDATE', 'DELETE')
+            )
+        ]
+
+    def test_unchanged(self):
+        writes = self.patch({
+            'name': 'seed 0',
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': amount}
+                for ingredient_id, (_, amount) in self.rows().items()
+            ],
+        })
+        self.assertEqual(writes, [])
+
+    def test_partial(self):
+        first, second, third, fourth = self.ingredient_ids
+        before = self.rows()
+        self.patch({'ingredients': [
+            {'id': first, 'amount': 10},
+            {'id': third, 'amount': before[third][1]},
+            {'id': fourth, 'amount': 4},
+        ]})
+        after = self.rows()
+        self.assertEqual(set(after), {first, third, fourth})
+        self.assertEqual(after[first], (before[first][0], 10))
+        self.assertEqual(after[third], before[third])
+        self.assertEqual(after[fourth][1], 4)
+        recipe = Recipe.objects.get(pk=self.recipe_id)
+        self.assertEqual(recipe.name, 'seed 0')
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertEqual(
+            dict(ShoppingCartItem.objects.filter(
+                user=self.buyer
+            ).values_list('ingredient_id', 'total_amount')),
+            {
+                ingredient_id: amount
+                for ingredient_id, (_, amount) in after.items()
+            },
+        )
+
+
+class BulkRecipesTest(APITestCase):
+    """Пакетное добавление и удаление избранного и списка покупок"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author_id, user_id = seed_users(2, 'planner')
+        cls.user = User.objects.get(pk=user_id)
+        cls.recipe_ids = seed_recipes(
+            [author_id], 4, seed_ingredients(2), per_recipe=1
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def post(self, url, data, status=200):
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status, response.data)
+        return response.data
+
+    def statuses(self, items):
+        return {item['id']: item['status'] for item in items}
+
+    def test_favorite(self):
+        first, second, third, fourth = self.recipe_ids
+        url = '/api/recipes/favorite/bulk/'
+        self.post(url, {'add': [first, third]})
+        data = self.post(url, {
+            'add': [first, second, 999999, second],
+            'remove': [third, fourth, 999998],
+        })
+        self.assertEqual(self.statuses(data['add']), {
+            first: 'exists', second: 'added', 999999: 'not_found',
+        })
+        self.assertEqual(self.statuses(data['remove']), {
+            third: 'removed', fourth: 'absent', 999998: 'not_found',
+        })
+        self.assertEqual(
+            set(Favorite.objects.filter(user=self.user).values_list(
+                'recipe_id', flat=True
+            )),
+            {first, second},
+        )
+        self.assertEqual(
+            dict(Recipe.objects.filter(
+                pk__in=self.recipe_ids
+            ).values_list('pk', 'favorites_count')),
+            {first: 1, second: 1, third: 0, fourth: 0},
+        )
+
+    def test_shopping_cart(self):
+        first, second = self.recipe_ids[:2]
+        url = '/api/recipes/shopping_cart/bulk/'
+        self.post(url, {'add': [first, second]})
+        self.post(url, {'remove': [first]})
+        self.assertEqual(
+            list(ShoppingList.objects.filter(
+                user=self.user
+            ).values_list('recipe_id', flat=True)),
+            [second],
+        )
+        self.assertEqual(
+            dict(ShoppingCartItem.objects.filter(
+                user=self.user
+            ).values_list('ingredient_id', 'total_amount')),
+            dict(RecipeIngredient.objects.filter(
+                recipe_id=second
+            ).values_list('ingredient_id', 'amount')),
+        )
+
+    def test_invalid(self):
+        first = self.recipe_ids[0]
+        url = '/api/recipes/favorite/bulk/'
+        self.post(url, {}, status=400)
+        self.post(url, {'add': [first], 'remove': [first]}, status=400)
+        self.assertFalse(Favorite.objects.exists())
+
+
+class RecipeTagsFilterTest(APITestCase):
+    """Фильтр по тегам в режимах any и all"""
+
+    @classmethod
+    def setUpTestData(cls):
+        recipe_ids = seed_recipes(seed_users(1, 'cook'), 3)
+        tags = [
+            Tag.objects.create(
+                name=slug, color=f'#00000{number}', slug=slug
+            )
+            for number, slug in enumerate(('soup', 'hot', 'spicy'))
+        ]
+        cls.recipe_ids = recipe_ids
+        for recipe_id, recipe_tags in zip(
+            recipe_ids, (tags[:1], tags[:2], tags[1:])
+        ):
+            Recipe.objects.get(pk=recipe_id).tags.set(recipe_tags)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_ids(self, query):
+        response = self.client.get(f'/api/recipes/?limit=10&{query}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return {recipe['id'] for recipe in response.data['results']}
+
+    def test_any(self):
+        first, second, third = self.recipe_ids
+        self.assertEqual(
+            self.get_ids('tags=soup&tags=hot'), {first, second, third}
+        )
+        self.assertEqual(
+            self.get_ids('tags=spicy&tags_mode=any'), {third}
+        )
+
+    def test_all(self):
+        second, third = self.recipe_ids[1:]
+        self.assertEqual(
+            self.get_ids('tags=soup&tags=hot&tags_mode=all'), {second}
+        )
+        self.assertEqual(
+            self.get_ids('tags=hot&tags=hot&tags=spicy&tags_mode=all'),
+            {third},
+        )
+
+    def test_unknown_slug(self):
+        for mode in ('any', 'all'):
+            with self.subTest(mode=mode):
+                response = self.client.get(
+                    f'/api/recipes/?tags=soup&tags=salad&tags_mode={mode}'
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('tags', response.data)
+
+
+@override_settings(TABLE_VERSION_TTL=0)
+class ReferenceCacheTest(APITestCase):
+    """ETag справочника меняется только при изменении таблицы"""
+
+    def setUp(self):
+        cache.clear()
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+
+    def get_etag(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_etag(self):
+        etag = self.get_etag()
+        self.assertEqual(self.get_etag(), etag)
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        self.assertNotEqual(self.get_etag(), etag)
+
+
+class ConcurrentWritesTest(TransactionTestCase):
+    """Параллельные добавления и удаления не расходятся со счетчиками.
+
+    Потокам нужна общая тестовая база: PostgreSQL или файл SQLite
+    из DB_TEST_NAME.
+    """
+
+    workers = 8
+    rounds = 4
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise SkipTest('База SQLite в памяти недоступна другим потокам')
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+        author_id, user_id = seed_users(2, 'writer')
+        self.user = User.objects.get(pk=user_id)
+        self.author_id = author_id
+        self.recipe_id = seed_recipes(
+            [author_id], 1, seed_ingredients(3), per_recipe=3
+        )[0]
+
+    def run_parallel(self, requests):
+        """Запросы (метод, url, данные) из нескольких потоков сразу"""
+        barrier = Barrier(len(requests))
+
+        def send(request):
+            method, url, data = request
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                return getattr(client, method)(url, data, format='json')
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(requests)) as pool:
+            statuses = [
+                response.status_code
+                for response in pool.map(send, requests)
+            ]
+        self.assertTrue(all(status < 500 for status in statuses), statuses)
+
+    def mixed(self, url, bulk_url=None):
+        """Добавления и удаления вперемешку, в том числе пакетные"""
+        requests = []
+        for number in range(self.workers):
+            if bulk_url and number % 4 == 3:
+                key = 'add' if number % 8 == 3 else 'remove'
+                requests.append(('post', bulk_url, {key: [self.recipe_id]}))
+            else:
+                method = 'post' if number % 2 else 'delete'
+                requests.append((method, url, None))
+        return requests
+
+    def test_favorite(self):
+        url = f'/api/recipes/{self.recipe_id}/favorite/'
+        for _ in range(self.rounds):
+            self.run_parallel(self.mixed(url, '/api/recipes/favorite/bulk/'))
+            self.assertEqual(
+                Recipe.objects.get(pk=self.recipe_id).favorites_count,
+                Favorite.objects.filter(recipe_id=self.recipe_id).count(),
+            )
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.recipe_id}/shopping_cart/'
+        amounts = dict(RecipeIngredient.objects.filter(
+            recipe_id=self.recipe_id
+        ).values_list('ingredient_id', 'amount'))
+        for _ in range(self.rounds):
+            self.run_parallel(
+                self.mixed(url, '/api/recipes/shopping_cart/bulk/')
+            )
+            in_cart = ShoppingList.objects.filter(
+                user=self.user, recipe_id=self.recipe_id
+            ).count()
+            self.assertEqual(
+                Recipe.objects.get(pk=self.recipe_id).shopping_carts_count,
+                in_cart,
+            )
+            self.assertEqual(
+                dict(ShoppingCartItem.objects.filter(
+                    user=self.user
+                ).values_list('ingredient_id', 'total_amount')),
+                amounts if in_cart else {},
+            )
+
+    def test_subscription(self):
+        url = f'/api/users/{self.author_id}/subscribe/'
+        for _ in range(self.rounds):
+            self.run_parallel(self.mixed(url))
+            follows = Follow.objects.filter(
+                user=self.user, author_id=self.author_id
+            ).count()
+            self.assertEqual(
+                User.objects.get(pk=self.author_id).followers_count, follows
+            )
+            self.assertEqual(
+                User.objects.get(pk=self.user.pk).following_count, follows
+            )
+
+
+@override_settings(BACKGROUND_TASKS_ASYNC=False)
+class RecipeImageTest(APITestCase):
+    """Варианты фото пересобираются, только если фото сменилось"""
+
+    def setUp(self):
+        media_root = TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        author_id = seed_users(1, 'photographer')[0]
+        self.client.force_authenticate(User.objects.get(pk=author_id))
+        recipe_id = seed_recipes([author_id], 1)[0]
+        self.recipe_id = recipe_id
+        self.url = f'/api/recipes/{recipe_id}/'
+
+    @staticmethod
+    def image(color):
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), color).save(buffer, 'PNG')
+        encoded = b64encode(buffer.getvalue()).decode('ascii')
+        return f'data:image/png;base64,{encoded}'
+
+    def state(self):
+        """Фото, варианты и счетчики ссылок на файлы"""
+        recipe = Recipe.objects.get(pk=self.recipe_id)
+        return (
+            recipe.image.name,
+            recipe.image_variants,
+            dict(MediaFile.objects.values_list('name', 'refcount')),
+        )
+
+    def patch_image(self, image):
+        """PATCH с фото, фоновые задачи после коммита не выполняются"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(
+                self.url, {'image': image}, format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        return callbacks
+
+    def upload(self, image):
+        for callback in self.patch_image(image):
+            callback()
+        return self.state()
+
+    def test_same_image(self):
+        image = self.image('orange')
+        before = self.upload(image)
+        self.assertTrue(before[1])
+        self.assertTrue(all(count == 1 for count in before[2].values()))
+        callbacks = self.patch_image(image)
+        self.assertEqual(self.state(), before)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.state(), before)
+
+    def test_new_image(self):
+        name, variants, _ = self.upload(self.image('orange'))
+        new_name, new_variants, refs = self.upload(self.image('green'))
+        self.assertNotEqual(new_name, name)
+        self.assertNotEqual(new_variants, variants)
+        self.assertEqual(refs[name], 0)
+        self.assertEqual(refs[new_name], 1)
+
+    def test_detail_image(self):
+        name, variants, _ = self.upload(self.image('orange'))
+        response = self.client.get(self.url)
+        self.assertTrue(response.data['image'].endswith(name))
+        self.assertEqual(
+            set(response.data['image_variants']), set(variants)
+        )
+        self.assertTrue(
+            response.data['image_variants']['card']['jpeg'].endswith(
+                variants['card']['jpeg']
+            )
+        )
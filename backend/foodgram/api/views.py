@@ -1,41 +1,121 @@
+from contextlib import contextmanager
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Exists,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Value
+)
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import (
+    IsAdminUser,
     IsAuthenticated,
     IsAuthenticatedOrReadOnly
 )
 from rest_framework.response import Response
 
-from .filters import RecipeFilter, IngredientFilter
-
-from .paginations import CustomPageNumberPagination
+from .caching import ReferenceCacheMixin, recipe_cache_stats
+from .filters import RecipeFilter
+from .paginations import (
+    CachedCountPagination,
+    CustomPageNumberPagination,
+    RecipeCursorPagination
+)
+from .parsers import LimitedJSONParser, StreamingMultiPartParser
 from .permissions import IsAuthorOrReadOnly
+from .queries import delete_returning, insert_or_ignore
+from .renderers import (
+    CsvShoppingCartRenderer,
+    PdfShoppingCartRenderer,
+    TxtShoppingCartRenderer
+)
 from .serializers import (
     BreifRecipeSerializer,
+    BulkRecipesSerializer,
     CustomUserSerializer,
     FollowingSerializer,
     IngredientSerializer,
     MainRecipeSerializer,
+    MatchedRecipeSerializer,
     ReadRecipeSerializer,
+    RecipeMatchSerializer,
     TagSerializer
 )
+from recipes.autocomplete import ingredient_autocomplete
+from recipes.feed import backfill, feed_keys, remove_author
+from recipes.matching import recipe_matcher
 from recipes.models import (
     Favorite,
     Ingredient,
     Recipe,
-    RecipeIngredient,
+    ShoppingCartItem,
     ShoppingList,
     Tag
 )
-from users.models import Follow
+from users.models import change_counters, Follow
 
 User = get_user_model()
 
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingList: 'shopping_carts_count',
+}
+
+
+def with_user_flags(queryset, user):
+    """Рецепты с автором и флагами текущего пользователя.
+
+    Теги и ингредиенты ReadRecipeSerializer подгружает сам, только для
+    рецептов, которых нет в кеше.
+    """
+    queryset = queryset.select_related('author').defer('search_vector')
+    if user.is_anonymous:
+        return queryset.annotate(
+            is_favorited=Value(False),
+            is_in_shopping_cart=Value(False),
+        )
+    return queryset.annotate(
+        is_favorited=Exists(
+            Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+        ),
+        is_in_shopping_cart=Exists(
+            ShoppingList.objects.filter(user=user, recipe=OuterRef('pk'))
+        ),
+    )
+
+
+def object_id(model, value):
+    """Первичный ключ из URL, для некорректного значения 404"""
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        raise NotFound
+
+
+@contextmanager
+def foreign_keys_or_404():
+    """Транзакция, в которой нарушение внешнего ключа означает 404.
+
+    В PostgreSQL внешние ключи Django отложенные, поэтому ошибка
+    возникает при коммите, а не при INSERT.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError:
+        raise NotFound
+
 
 class CustomUserViewSet(UserViewSet):
     """Вьюсет работы с пользователями"""
@@ -44,6 +124,38 @@ class CustomUserViewSet(UserViewSet):
     pagination_class = CustomPageNumberPagination
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    def get_recipes_limit(self):
+        """Значение параметра recipes_limit или None, если он не задан"""
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return max(recipes_limit, 0)
+
+    def get_subscriptions(self, user):
+        """Подписки пользователя с рецептами авторов и их количеством.
+
+        recipes_limit применяется в SQL: для каждого автора на странице
+        выбираются только последние N рецептов коррелированным подзапросом.
+        """
+        recipes = Recipe.objects.defer('search_vector')
+        recipes_limit = self.get_recipes_limit()
+        if recipes_limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('pk')[:recipes_limit]
+            ))
+        return Follow.objects.filter(user=user).select_related(
+            'author'
+        ).prefetch_related(
+            Prefetch(
+                'author__recipe_author',
+                queryset=recipes,
+                to_attr='limited_recipes'
+            )
+        ).order_by('id')
+
     @action(
         methods=('GET', ),
         url_path='subscriptions',
@@ -53,7 +165,7 @@ class CustomUserViewSet(UserViewSet):
     def read_subscribe(self, request):
         """Метод вывода существующих подписок"""
         user = request.user
-        subscriptions = Follow.objects.filter(user=user)
+        subscriptions = self.get_subscriptions(user)
         page = self.paginate_queryset(subscriptions)
         serializer = FollowingSerializer(
             page,
@@ -62,6 +174,38 @@ class CustomUserViewSet(UserViewSet):
         )
         return self.get_paginated_response(serializer.data)
 
+    @action(
+        methods=('GET', ),
+        url_path='feed',
+        detail=False,
+        permission_classes=(IsAuthenticated,)
+    )
+    def feed(self, request):
+        """Лента рецептов авторов из подписок с keyset пагинацией.
+
+        Ключи страницы выбираются из входящих и неразосланных рецептов,
+        затем рецепты страницы читаются одним запросом по id.
+        """
+        paginator = RecipeCursorPagination()
+        paginator.prepare(request)
+        keys = sorted(
+            feed_keys(request.user, paginator.seek),
+            reverse=not paginator.reverse,
+        )[:paginator.page_size + 1]
+        recipes = with_user_flags(Recipe.objects.all(), request.user).in_bulk(
+            [recipe_id for _, recipe_id in keys]
+        )
+        page = paginator.paginate_results([
+            recipes[recipe_id] for _, recipe_id in keys
+            if recipe_id in recipes
+        ])
+        serializer = ReadRecipeSerializer(
+            page,
+            many=True,
+            context={'request': request}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
     @action(
         methods=('POST', 'DELETE'),
         url_path='subscribe',
@@ -69,78 +213,232 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def subscribe(self, request, id=None):
-        """Метод добавления/удаления подписки на пользователя"""
+        """Метод добавления/удаления подписки на пользователя.
+
+        Подписка создается одним INSERT ... ON CONFLICT DO NOTHING и
+        удаляется одним DELETE ... RETURNING, поэтому параллельные
+        запросы не меняют счетчики дважды.
+        """
         user = request.user
-        author = get_object_or_404(User, id=id)
-        if request.method == 'POST':
-            if Follow.objects.filter(user=user, author=author).exists():
+        author_id = object_id(User, id)
+        if request.method == 'DELETE':
+            return self.unsubscribe(user, author_id)
+        if user.id == author_id:
+            return Response(
+                {'Error': 'На себя подписаться нельзя'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with foreign_keys_or_404():
+            subscription_ids = insert_or_ignore(
+                Follow, [{'user_id': user.id, 'author_id': author_id}]
+            )
+            if not subscription_ids:
                 return Response(
                     {'Error': 'Уже есть такая подписка'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            if user.id == author.id:
-                return Response(
-                    {'Error': 'На себя подписаться нельзя'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            subscription = Follow.objects.create(
-                user=user,
-                author=author
+            if not change_counters(
+                User.objects.filter(pk=author_id), followers_count=1
+            ):
+                raise NotFound
+            change_counters(
+                User.objects.filter(pk=user.pk), following_count=1
             )
-            serializer = FollowingSerializer(
-                subscription,
-                context={'request': request},
+            subscription = self.get_subscriptions(user).get(
+                pk=subscription_ids[0]
             )
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        Follow.objects.get(
-            user=user,
-            author=self.get_object()
-        ).delete()
+            backfill(user, subscription.author)
+        serializer = FollowingSerializer(
+            subscription,
+            context={'request': request},
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @transaction.atomic
+    def unsubscribe(self, user, author_id):
+        """Удаление подписки, 400 если ее не было, 404 если нет автора"""
+        if not delete_returning(Follow, user_id=user.id, author_id=author_id):
+            get_object_or_404(User, pk=author_id)
+            return Response(
+                {'Error': 'Подписки на этого автора нет'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        change_counters(User.objects.filter(pk=user.pk), following_count=-1)
+        change_counters(User.objects.filter(pk=author_id), followers_count=-1)
+        remove_author(user, author_id)
         return Response(
             {'message': 'Подписка удалена'},
             status=status.HTTP_204_NO_CONTENT
         )
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет игредиентов"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(self.autocomplete, request)
+
+    def autocomplete(self, request):
+        """Автодополнение ингредиентов по параметру name"""
+        return Response(ingredient_autocomplete.search(
+            request.query_params.get('name', '')
+        ))
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """Вьюсет рецептов"""
-    queryset = Recipe.objects.all()
     serializer_class = MainRecipeSerializer
+    pagination_class = CachedCountPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    parser_classes = (LimitedJSONParser, StreamingMultiPartParser)
     permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly,)
 
+    @property
+    def paginator(self):
+        """Keyset пагинация по запросу с pagination=cursor или cursor.
+
+        Ключ курсора - дата публикации, поэтому при другой сортировке и
+        при поиске по релевантности используется постраничная пагинация.
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            by_date = (
+                params.get('ordering', 'new') == 'new'
+                and not params.get('search')
+            )
+            if by_date and (
+                params.get('pagination') == 'cursor'
+                or RecipeCursorPagination.cursor_query_param in params
+            ):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        return with_user_flags(Recipe.objects.all(), self.request.user)
+
     def get_serializer_class(self):
         """Выбор сериализатора в зависимости от типа запроса POST/PATCH"""
         if self.request.method in ('POST', 'PATCH'):
             return MainRecipeSerializer
         return ReadRecipeSerializer
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingCartItem.objects.change_recipe(instance, {
+            ingredient_id: -amount for ingredient_id, amount
+            in ShoppingCartItem.objects.recipe_amounts(instance).items()
+        })
+        instance.delete()
+        change_counters(
+            User.objects.filter(pk=instance.author_id), recipes_count=-1
+        )
+
     def add_obj(self, model, user, pk):
-        """Метод добавления рецепта"""
-        recipe = get_object_or_404(Recipe, pk=pk)
-        obj, created = model.objects.get_or_create(user=user, recipe=recipe)
-        if not created:
-            return Response(status=status.HTTP_304_NOT_MODIFIED)
-        serializer = BreifRecipeSerializer(recipe)
+        """Добавление рецепта одним INSERT ... ON CONFLICT DO NOTHING.
+
+        Повторное добавление, в том числе параллельным запросом, не
+        меняет счетчик и итоги списка покупок. Отсутствие рецепта видно
+        по необновленному счетчику, до проверки внешнего ключа.
+        """
+        recipe_id = object_id(Recipe, pk)
+        with foreign_keys_or_404():
+            if not insert_or_ignore(
+                model, [{'user_id': user.id, 'recipe_id': recipe_id}]
+            ):
+                return Response(status=status.HTTP_304_NOT_MODIFIED)
+            if not change_counters(
+                Recipe.objects.filter(pk=recipe_id),
+                **{RECIPE_COUNTERS[model]: 1}
+            ):
+                raise NotFound
+            if model is ShoppingList:
+                ShoppingCartItem.objects.add_recipe(user, recipe_id)
+        serializer = BreifRecipeSerializer(
+            get_object_or_404(Recipe, pk=recipe_id)
+        )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def delete_obj(self, model, user, pk):
-        """Метод удаления рецепта"""
-        recipe = get_object_or_404(Recipe, pk=pk)
-        obj = get_object_or_404(model, user=user, recipe=recipe)
-        obj.delete()
+        """Удаление рецепта одним DELETE ... RETURNING"""
+        recipe_id = object_id(Recipe, pk)
+        if not delete_returning(model, user_id=user.id, recipe_id=recipe_id):
+            raise NotFound
+        change_counters(
+            Recipe.objects.filter(pk=recipe_id),
+            **{RECIPE_COUNTERS[model]: -1}
+        )
+        if model is ShoppingList:
+            ShoppingCartItem.objects.remove_recipe(user, recipe_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def bulk_objs(self, model, request):
+        """Пакетное добавление и удаление рецептов одной транзакцией.
+
+        Новые строки вставляются одним INSERT ... ON CONFLICT DO NOTHING,
+        удаляемые - одним DELETE по списку id, оба запроса возвращают
+        recipe_id затронутых строк. Счетчики, итоги списка покупок и
+        статусы added/removed считаются только по этим id, поэтому строку,
+        которую параллельный запрос успел вставить или удалить, второй
+        раз не учитывают. Для каждого id возвращается статус: added,
+        exists, removed, absent или not_found.
+        """
+        serializer = BulkRecipesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add = serializer.validated_data['add']
+        remove = serializer.validated_data['remove']
+        user = request.user
+        found = set(Recipe.objects.filter(
+            pk__in=add + remove
+        ).values_list('pk', flat=True))
+        with foreign_keys_or_404():
+            added = set(insert_or_ignore(
+                model,
+                [
+                    {'user_id': user.id, 'recipe_id': pk}
+                    for pk in add if pk in found
+                ],
+                returning='recipe_id',
+            ))
+            removed = set(delete_returning(
+                model,
+                returning='recipe_id',
+                user_id=user.id,
+                recipe_id__in=remove,
+            ))
+            counter = RECIPE_COUNTERS[model]
+            change_counters(
+                Recipe.objects.filter(pk__in=added), **{counter: 1}
+            )
+            change_counters(
+                Recipe.objects.filter(pk__in=removed), **{counter: -1}
+            )
+            if model is ShoppingList:
+                ShoppingCartItem.objects.add_recipe(user, *added)
+                ShoppingCartItem.objects.remove_recipe(user, *removed)
+        return Response({
+            'add': [
+                {'id': pk, 'status': (
+                    'added' if pk in added
+                    else 'exists' if pk in found else 'not_found'
+                )}
+                for pk in add
+            ],
+            'remove': [
+                {'id': pk, 'status': (
+                    'removed' if pk in removed
+                    else 'absent' if pk in found else 'not_found'
+                )}
+                for pk in remove
+            ],
+        })
+
     @action(
         detail=True,
         methods=('POST', 'DELETE'),
@@ -153,6 +451,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self.delete_obj(Favorite, request.user, pk)
         return self.add_obj(Favorite, request.user, pk)
 
+    @action(
+        detail=False,
+        methods=('POST',),
+        url_path='favorite/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        """Пакетное добавление/удаление в избранное"""
+        return self.bulk_objs(Favorite, request)
+
     @action(
         detail=True,
         methods=('POST', 'DELETE'),
@@ -167,29 +475,101 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(
         detail=False,
-        methods=('GET',),
+        methods=('POST',),
+        url_path='shopping_cart/bulk',
         permission_classes=(IsAuthenticated,)
     )
+    def shopping_cart_bulk(self, request):
+        """Пакетное добавление/удаление в список покупок"""
+        return self.bulk_objs(ShoppingList, request)
+
+    @action(
+        detail=False,
+        methods=('GET',),
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(
+            TxtShoppingCartRenderer,
+            CsvShoppingCartRenderer,
+            PdfShoppingCartRenderer,
+        )
+    )
     def download_shopping_cart(self, request):
-        """Выгрузка списка покупок в формате txt"""
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shoppinglist_recipe__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(ingredient_amount=Sum('amount'))
-        shopping_list = ['Список покупок:\n']
-        for ingredient in ingredients:
-            name = ingredient['ingredient__name']
-            unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['ingredient_amount']
-            shopping_list.append(f'\n{name} - {amount}, {unit}')
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; '
-        'filename="shopping_cart.txt"'
+        """Потоковая выгрузка списка покупок.
+
+        Формат (txt, csv, pdf) выбирается параметром format или заголовком
+        Accept, по умолчанию txt.
+        """
+        ingredients = ShoppingCartItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'total_amount'
+        ).order_by('ingredient__name')
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator(
+                chunk_size=settings.SHOPPING_CART_CHUNK_SIZE
+            )),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{renderer.format}"'
+        )
         return response
 
+    @action(
+        detail=False,
+        methods=('GET',),
+        url_path='match',
+    )
+    def match(self, request):
+        """Подбор рецептов по имеющимся ингредиентам.
+
+        Рецепты идут по убыванию доли имеющихся ингредиентов, в ответе
+        число найденных (matched_count) и недостающих (missing_count).
+        """
+        params = RecipeMatchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        matches = recipe_matcher.match(
+            params.validated_data['ingredients'],
+            params.validated_data.get('max_missing'),
+        )
+        paginator = CustomPageNumberPagination()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        recipes = with_user_flags(
+            Recipe.objects.filter(pk__in=[match[0] for match in page]),
+            request.user
+        ).in_bulk()
+        found = []
+        for recipe_id, matched, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.matched_count = matched
+                recipe.missing_count = missing
+                found.append(recipe)
+        serializer = MatchedRecipeSerializer(
+            found,
+            many=True,
+            context={'request': request}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=('GET',),
+        url_path='cache_stats',
+        permission_classes=(IsAdminUser,)
+    )
+    def cache_stats(self, request):
+        """Попадания и промахи кеша содержимого рецептов"""
+        return Response(recipe_cache_stats())
+
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет тегов"""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -66,7 +66,19 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'TEST': {
+            'NAME': os.getenv('DB_TEST_NAME'),
+        },
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
     }
 }
 
@@ -137,3 +149,38 @@ RECIPE_MAX_LENGTH = 200
 COLOR_MAX_LENGTH = 7
 MIN_INGREDIENTS_QTY = 1
 MIN_COOKING_TIME = 1
+SHOPPING_CART_CHUNK_SIZE = 2000
+PDF_FONT_PATH = os.getenv(
+    'PDF_FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+INGREDIENT_AUTOCOMPLETE_LIMIT = 20
+INGREDIENT_INDEX_ENABLED = True
+INGREDIENT_INDEX_MAX_SIZE = 100000
+INGREDIENT_INDEX_TTL = 300
+REFERENCE_CACHE_MAX_AGE = 60
+TABLE_VERSION_TTL = 60
+REFERENCE_PAYLOAD_CACHE_SIZE = 512
+RECIPE_COUNT_CACHE_TTL = 30
+RECIPE_COUNT_ESTIMATE_THRESHOLD = 10000
+TRENDING_HALF_LIFE_HOURS = 48
+TRENDING_FAVORITE_WEIGHT = 1
+TRENDING_CART_WEIGHT = 2
+TRENDING_REFRESH_LAG = 60
+BACKGROUND_TASKS_ASYNC = True
+BACKGROUND_TASKS_WORKERS = 2
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_BACKFILL_SIZE = 20
+IMAGE_VARIANTS = {'thumbnail': 160, 'card': 480, 'full': 1280}
+IMAGE_FORMATS = {'webp': 80, 'jpeg': 85}
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+RECIPE_IMAGE_MAX_SIDE = 8000
+RECIPE_FORM_MAX_SIZE = 256 * 1024
+MEDIA_GC_GRACE = 24 * 60 * 60
+RECIPE_CACHE_TTL = 10 * 60
+BULK_RECIPES_MAX_SIZE = 100
+SEARCH_CONFIG = 'russian'
+RECIPE_MATCH_INDEX_ENABLED = True
+RECIPE_MATCH_INDEX_MAX_SIZE = 200000
+RECIPE_MATCH_INDEX_TTL = 300
+RECIPE_MATCH_MAX_INGREDIENTS = 50
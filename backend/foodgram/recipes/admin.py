@@ -5,6 +5,7 @@ from .models import (
     Ingredient,
     Recipe,
     RecipeIngredient,
+    ShoppingCartItem,
     ShoppingList,
     Tag
 )
@@ -27,7 +28,7 @@ class IngredientAdmin(admin.ModelAdmin):
 
 class RecipeAdmin(admin.ModelAdmin):
     """Админка модели Recipe"""
-    list_display = ('pk', 'author', 'name',)
+    list_display = ('pk', 'author', 'name', 'favorites_count')
     search_fields = ('name', 'author__username', 'author__email')
     list_filter = ('tags',)
     empty_value_display = '-empty-'
@@ -40,6 +41,13 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     empty_value_display = '-empty-'
 
 
+class ShoppingCartItemAdmin(admin.ModelAdmin):
+    """Админка модели ShoppingCartItem"""
+    list_display = ('pk', 'user', 'ingredient', 'total_amount')
+    search_fields = ('ingredient__name', 'user__username', 'user__email')
+    readonly_fields = ('user', 'ingredient', 'total_amount')
+
+
 class ShoppingListAdmin(admin.ModelAdmin):
     """Админка модели ShoppingList"""
     list_display = ('pk', 'user', 'recipe',)
@@ -57,5 +65,6 @@ admin.site.register(Favorite, FavoriteAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(RecipeIngredient, RecipeIngredientAdmin)
+admin.site.register(ShoppingCartItem, ShoppingCartItemAdmin)
 admin.site.register(ShoppingList, ShoppingListAdmin)
 admin.site.register(Tag, TagAdmin)
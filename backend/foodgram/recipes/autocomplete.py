@@ -0,0 +1,117 @@
+from bisect import bisect_left
+from operator import itemgetter
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import Ingredient
+
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+
+
+class IngredientAutocomplete:
+    """Поиск ингредиентов по началу и вхождению подстроки в название.
+
+    Совпадения по началу названия идут раньше совпадений по подстроке,
+    результат ограничен INGREDIENT_AUTOCOMPLETE_LIMIT. Поиск идет по
+    отсортированному индексу в памяти процесса (bisect по названиям в
+    casefold). Индекс сбрасывается сигналами изменения Ingredient в этом
+    процессе и перестраивается не реже INGREDIENT_INDEX_TTL секунд для
+    остальных воркеров. Если индекс отключен или справочник больше
+    INGREDIENT_INDEX_MAX_SIZE, запрос уходит в БД (pg_trgm индекс).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+        self._built_at = 0
+
+    def invalidate(self, **kwargs):
+        """Сброс индекса, подходит как обработчик сигналов"""
+        self._index = None
+
+    def search(self, query, limit=None):
+        """Список ингредиентов в виде словарей с полями IngredientSerializer"""
+        if limit is None:
+            limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        query = query.strip()
+        index = self._get_index()
+        if index is None:
+            return self._search_db(query, limit)
+        return self._search_index(index, query.casefold(), limit)
+
+    def _get_index(self):
+        if not settings.INGREDIENT_INDEX_ENABLED:
+            return None
+        index = self._index
+        if (
+            index is not None
+            and monotonic() - self._built_at < settings.INGREDIENT_INDEX_TTL
+        ):
+            return index or None
+        with self._lock:
+            if self._index is index:
+                self._index = self._build_index()
+                self._built_at = monotonic()
+            return self._index or None
+
+    @staticmethod
+    def _build_index():
+        """Отсортированные ключи и параллельный им список ингредиентов.
+
+        Пустой кортеж означает, что справочник слишком велик для памяти.
+        """
+        if Ingredient.objects.count() > settings.INGREDIENT_INDEX_MAX_SIZE:
+            return ()
+        items = sorted(
+            (
+                (ingredient['name'].casefold(), ingredient)
+                for ingredient in Ingredient.objects.values(*INGREDIENT_FIELDS)
+            ),
+            key=itemgetter(0)
+        )
+        return (
+            [key for key, _ in items],
+            [ingredient for _, ingredient in items],
+        )
+
+    @staticmethod
+    def _search_index(index, query, limit):
+        keys, ingredients = index
+        result = []
+        position = bisect_left(keys, query)
+        while (
+            position < len(keys)
+            and len(result) < limit
+            and keys[position].startswith(query)
+        ):
+            result.append(ingredients[position])
+            position += 1
+        if len(result) < limit and query:
+            for key, ingredient in zip(keys, ingredients):
+                if query in key and not key.startswith(query):
+                    result.append(ingredient)
+                    if len(result) == limit:
+                        break
+        return result
+
+    @staticmethod
+    def _search_db(query, limit):
+        return list(
+            Ingredient.objects.filter(
+                name__icontains=query
+            ).annotate(
+                is_substring=Case(
+                    When(name__istartswith=query, then=Value(0)),
+                    default=Value(1),
+                    output_field=IntegerField(),
+                )
+            ).order_by(
+                'is_substring', 'name'
+            ).values(*INGREDIENT_FIELDS)[:limit]
+        )
+
+
+ingredient_autocomplete = IngredientAutocomplete()
@@ -0,0 +1,39 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.BACKGROUND_TASKS_WORKERS,
+        thread_name_prefix='background',
+    )
+
+
+def run_task(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Ошибка фоновой задачи %s%s', func.__name__, args)
+    finally:
+        connection.close()
+
+
+def run_after_commit(func, *args):
+    """Запуск func(*args) после коммита текущей транзакции.
+
+    При BACKGROUND_TASKS_ASYNC задача выполняется в пуле потоков процесса
+    и ответ на запрос ее не ждет, иначе сразу после коммита.
+    """
+    if settings.BACKGROUND_TASKS_ASYNC:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_task, func, *args)
+        )
+    else:
+        transaction.on_commit(lambda: func(*args))
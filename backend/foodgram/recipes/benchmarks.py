@@ -0,0 +1,68 @@
+import ctypes
+import re
+import tracemalloc
+from statistics import median
+from time import perf_counter
+
+MIB = 1024 * 1024
+
+
+def timings(func, repeat):
+    """Время выполнения func в миллисекундах: медиана и максимум"""
+    results = []
+    for _ in range(repeat):
+        started = perf_counter()
+        func()
+        results.append((perf_counter() - started) * 1000)
+    return median(results), max(results)
+
+
+def read_status(name):
+    """Значение из /proc/self/status в байтах или None вне Linux"""
+    try:
+        with open('/proc/self/status') as status:
+            match = re.search(rf'^{name}:\s+(\d+) kB', status.read(), re.M)
+    except OSError:
+        return None
+    return int(match.group(1)) * 1024 if match else None
+
+
+def reset_peak_rss():
+    """Сброс пика RSS процесса (VmHWM), доступно в Linux 4.0+.
+
+    Перед сбросом свободная память кучи возвращается системе, иначе
+    замер займет ее без роста RSS.
+    """
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_memory(func):
+    """Пиковый прирост памяти при выполнении func в байтах.
+
+    Возвращает пару (python, rss). python - пик объектов Python по
+    tracemalloc, буферы C библиотек (Pillow, драйвер БД) он не видит.
+    rss - прирост пика RSS процесса относительно RSS до запуска, None,
+    если пик нельзя сбросить. func выполняется дважды: служебные данные
+    tracemalloc не должны попасть в замер RSS.
+    """
+    rss_peak = None
+    if reset_peak_rss():
+        rss_before = read_status('VmRSS')
+        func()
+        rss_peak = read_status('VmHWM') - rss_before
+    tracemalloc.start()
+    try:
+        func()
+        python_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return python_peak, rss_peak
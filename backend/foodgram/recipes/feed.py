@@ -0,0 +1,103 @@
+from itertools import islice
+
+from django.conf import settings
+
+from users.models import Follow
+
+from .background import run_after_commit
+from .models import FeedItem, Recipe
+
+
+def is_popular(author):
+    """Рецепты автора с большим числом подписчиков читаются при запросе"""
+    return author.followers_count > settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def fan_out(recipe_id):
+    """Запись рецепта во входящие ленты подписчиков автора пачками.
+
+    Возвращает количество подписчиков, для популярного автора запись
+    не выполняется. После записи рецепт помечается разосланным, до этого
+    лента читает его из рецептов.
+    """
+    recipe = Recipe.objects.select_related('author').only(
+        'id', 'pub_date', 'author__id', 'author__followers_count'
+    ).filter(pk=recipe_id).first()
+    if recipe is None or is_popular(recipe.author):
+        return 0
+    follower_ids = Follow.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True).iterator(
+        chunk_size=settings.FEED_FANOUT_BATCH_SIZE
+    )
+    written = 0
+    for batch in iter(
+        lambda: list(islice(follower_ids, settings.FEED_FANOUT_BATCH_SIZE)),
+        []
+    ):
+        FeedItem.objects.bulk_create(
+            [
+                FeedItem(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    pub_date=recipe.pub_date,
+                )
+                for user_id in batch
+            ],
+            ignore_conflicts=True,
+        )
+        written += len(batch)
+    Recipe.objects.filter(pk=recipe_id).update(fanned_out=True)
+    return written
+
+
+def schedule_fan_out(recipe):
+    """Рассылка рецепта в ленты в фоне после коммита транзакции"""
+    run_after_commit(fan_out, recipe.pk)
+
+
+def backfill(user, author):
+    """Последние разосланные рецепты автора в ленту нового подписчика.
+
+    Неразосланные рецепты, в том числе рецепты популярного автора, лента
+    и так читает из рецептов.
+    """
+    recipes = Recipe.objects.filter(
+        author=author, fanned_out=True
+    ).order_by('-pub_date', '-id').values_list(
+        'pk', 'pub_date'
+    )[:settings.FEED_BACKFILL_SIZE]
+    FeedItem.objects.bulk_create(
+        [
+            FeedItem(user=user, recipe_id=recipe_id, pub_date=pub_date)
+            for recipe_id, pub_date in recipes
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_author(user, author):
+    """Удаление рецептов автора из ленты после отписки"""
+    FeedItem.objects.filter(user=user, recipe__author=author).delete()
+
+
+def feed_keys(user, seek):
+    """Ключи (pub_date, id рецепта) страницы ленты подписок.
+
+    Ключи читаются из двух источников: входящие пользователя по индексу
+    (user, pub_date, recipe) и неразосланные рецепты авторов из подписок
+    по частичному индексу. Неразосланы рецепты, опубликованные, пока
+    автор был популярным, и рецепты, рассылка которых еще идет, поэтому
+    рецепты не пропадают из ленты, когда автор теряет подписчиков.
+    seek(queryset, id_field) упорядочивает queryset по ключу, применяет
+    курсор и ограничивает размер страницы. Результат - множество ключей
+    обоих источников, рецепт из обоих источников в нем один раз.
+    """
+    inbox = FeedItem.objects.filter(user=user).values_list(
+        'pub_date', 'recipe_id'
+    )
+    pulled = Recipe.objects.filter(
+        fanned_out=False,
+        author__in=Follow.objects.filter(user=user).values('author_id'),
+    ).values_list('pub_date', 'id')
+    return set(seek(inbox, 'recipe_id')) | set(seek(pulled, 'id'))
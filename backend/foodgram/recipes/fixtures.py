@@ -0,0 +1,102 @@
+from itertools import islice
+
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Follow, User
+
+from .models import Ingredient, Recipe, RecipeIngredient
+
+BATCH_SIZE = 5000
+
+
+def bulk_create(model, objects):
+    """Вставка объектов из генератора пачками по BATCH_SIZE"""
+    objects = iter(objects)
+    for batch in iter(lambda: list(islice(objects, BATCH_SIZE)), []):
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def created_ids(model, create):
+    """id строк, вставленных функцией create, по возрастанию.
+
+    SQLite не возвращает id из bulk_create, поэтому новые строки
+    выбираются по id больше прежнего максимума.
+    """
+    last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    create()
+    return list(model.objects.filter(pk__gt=last_id).order_by(
+        'pk'
+    ).values_list('pk', flat=True))
+
+
+def seed_users(count, prefix='seed'):
+    return created_ids(User, lambda: bulk_create(User, (
+        User(
+            email=f'{prefix}{number}@example.com',
+            username=f'{prefix}{number}',
+            first_name=prefix,
+            last_name=prefix,
+        )
+        for number in range(count)
+    )))
+
+
+def seed_ingredients(count, prefix='seed'):
+    return created_ids(Ingredient, lambda: bulk_create(Ingredient, (
+        Ingredient(name=f'{prefix} {number}', measurement_unit='г')
+        for number in range(count)
+    )))
+
+
+def seed_recipes(author_ids, count, ingredient_ids=(), per_recipe=5,
+                 fanned_out=True, prefix='seed'):
+    """count рецептов авторов по кругу, у каждого per_recipe ингредиентов.
+
+    Возвращает id рецептов в порядке публикации.
+    """
+    recipe_ids = created_ids(Recipe, lambda: bulk_create(Recipe, (
+        Recipe(
+            name=f'{prefix} {number}',
+            text=prefix,
+            image='recipes/images/seed.png',
+            author_id=author_ids[number % len(author_ids)],
+            cooking_time=1,
+            fanned_out=fanned_out,
+        )
+        for number in range(count)
+    )))
+    if ingredient_ids:
+        bulk_create(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_ids[
+                    (number + shift) % len(ingredient_ids)
+                ],
+                amount=shift + 1,
+            )
+            for number, recipe_id in enumerate(recipe_ids)
+            for shift in range(per_recipe)
+        ))
+    return recipe_ids
+
+
+def seed_follows(user_ids, author_ids):
+    """Подписки каждого пользователя на каждого автора со счетчиками"""
+    bulk_create(Follow, (
+        Follow(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in author_ids
+        if user_id != author_id
+    ))
+    for field, counter, ids in (
+        ('author', 'followers_count', author_ids),
+        ('user', 'following_count', user_ids),
+    ):
+        User.objects.filter(pk__in=ids).update(**{counter: Coalesce(
+            Subquery(
+                Follow.objects.filter(**{field: OuterRef('pk')}).order_by(
+                ).values(field).annotate(count=Count('pk')).values('count')
+            ),
+            0
+        )})
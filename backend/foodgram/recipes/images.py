@@ -0,0 +1,129 @@
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .background import run_after_commit
+from .media import change_refs, variant_names
+from .models import Recipe
+from .storage import touch
+
+VARIANTS_DIR = 'recipes/variants'
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+logger = logging.getLogger(__name__)
+
+
+def decode(file, max_size):
+    """Фото в RGB с примененным поворотом из EXIF.
+
+    draft позволяет декодеру JPEG сразу читать уменьшенную копию, если
+    оригинал намного больше самого крупного варианта.
+    """
+    image = Image.open(file)
+    image.draft('RGB', (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, extension):
+    """Сжатое изображение без метаданных (EXIF, ICC, комментарии)"""
+    buffer = BytesIO()
+    image.save(
+        buffer,
+        PIL_FORMATS[extension],
+        quality=settings.IMAGE_FORMATS[extension],
+        optimize=extension == 'jpeg',
+    )
+    return buffer.getvalue()
+
+
+def variant_name(image_name, size, extension):
+    """Путь варианта определяется содержимым оригинала и размером"""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{VARIANTS_DIR}/{stem[:2]}/{stem}_{size}.{extension}'
+
+
+def write_variants(recipe, variants, paths, missing):
+    """Кодирование вариантов из missing, False если фото не читается"""
+    try:
+        with recipe.image.open('rb') as file:
+            image = decode(file, variants[0][1])
+    except (FileNotFoundError, UnidentifiedImageError) as error:
+        logger.warning('Фото рецепта %s не прочитано: %s', recipe.pk, error)
+        return False
+    for variant, size in variants:
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+        for extension, path in paths[variant].items():
+            if path in missing:
+                default_storage.delete(path)
+                default_storage.save(
+                    path, ContentFile(encode(image, extension))
+                )
+    return True
+
+
+def build_variants(recipe_id, force=False):
+    """Генерация уменьшенных копий фото рецепта во всех форматах.
+
+    Имена вариантов зависят только от оригинала, поэтому для одинаковых
+    фото они общие и повторно не кодируются, если не задан force. Фото
+    декодируется один раз, каждый следующий вариант уменьшается из
+    предыдущего. Результат сохраняется, только если фото не сменилось за
+    время обработки. Отсутствующее или нечитаемое фото пропускается.
+    Ненужные больше файлы удаляет команда collect_media.
+    """
+    recipe = Recipe.objects.only(
+        'image', 'image_variants'
+    ).filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return {}
+    variants = sorted(
+        settings.IMAGE_VARIANTS.items(), key=lambda item: -item[1]
+    )
+    paths = {
+        variant: {
+            extension: variant_name(recipe.image.name, size, extension)
+            for extension in settings.IMAGE_FORMATS
+        }
+        for variant, size in variants
+    }
+    missing = set()
+    for path in variant_names(paths):
+        if force or not default_storage.exists(path):
+            missing.add(path)
+        else:
+            touch(default_storage, path)
+    if missing and not write_variants(recipe, variants, paths, missing):
+        return {}
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=recipe.image.name
+    ).update(image_variants=paths)
+    if not updated:
+        return {}
+    change_refs(
+        added=variant_names(paths),
+        removed=variant_names(recipe.image_variants),
+    )
+    return paths
+
+
+def schedule_variants(recipe):
+    """Генерация уменьшенных копий в фоне после коммита транзакции"""
+    run_after_commit(build_variants, recipe.pk)
+
+
+def variant_path(recipe, variant, extension='jpeg'):
+    """Путь к варианту фото или к оригиналу, пока варианты не готовы"""
+    path = recipe.image_variants.get(variant, {}).get(extension)
+    return path or recipe.image.name or None
@@ -0,0 +1,108 @@
+from functools import partial
+from random import Random
+from statistics import median
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.autocomplete import IngredientAutocomplete
+from recipes.benchmarks import MIB, peak_memory, timings
+from recipes.management.commands.import_data import (
+    DEFAULT_PATH,
+    Command as ImportCommand,
+    read_csv
+)
+from recipes.models import Ingredient
+
+
+def sample_queries(names, count, seed=0):
+    """Запросы автодополнения по группам: начала названий и подстроки"""
+    random = Random(seed)
+    queries = {}
+    for length in (1, 2, 3, 5):
+        queries[f'начало названия, {length} симв.'] = [
+            name[:length] for name in random.sample(names, count)
+        ]
+    middles = []
+    for name in random.sample(names, count):
+        start = random.randrange(max(len(name) - 3, 1))
+        middles.append(name[start:start + 3])
+    queries['подстрока, 3 симв.'] = middles
+    return queries
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Замер автодополнения ингредиентов на справочнике из csv: сборка '
+        'индекса в памяти и время ответа индекса в сравнении с запросом '
+        'в БД. Ингредиенты загружаются в транзакции и откатываются после '
+        'замера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=DEFAULT_PATH,
+            help='Путь к файлу ingredients.csv',
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=50,
+            help='Число запросов в каждой группе',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            help='Число повторов каждого запроса',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, options):
+        with open(options['path'], encoding='utf-8') as file:
+            ImportCommand.load_bulk(read_csv(file), 5000)
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        self.stdout.write(f'Ингредиентов в справочнике: {len(names)}')
+        repeat = options['repeat']
+        median_time, worst = timings(
+            IngredientAutocomplete._build_index, repeat
+        )
+        python_peak, _ = peak_memory(IngredientAutocomplete._build_index)
+        self.stdout.write(
+            f'Сборка индекса: {median_time:.1f} мс '
+            f'(максимум {worst:.1f} мс), пик Python '
+            f'{python_peak / MIB:.1f} МиБ'
+        )
+        index = IngredientAutocomplete._build_index()
+        limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        searches = (
+            ('индекс', lambda query: IngredientAutocomplete._search_index(
+                index, query.casefold(), limit
+            )),
+            ('БД', lambda query: IngredientAutocomplete._search_db(
+                query, limit
+            )),
+        )
+        queries = sample_queries(
+            names, min(options['queries'], len(names))
+        )
+        for group, group_queries in queries.items():
+            self.stdout.write(f'{group}, {len(group_queries)} запросов:')
+            for name, search in searches:
+                medians, worst = zip(*(
+                    timings(partial(search, query), repeat)
+                    for query in group_queries
+                ))
+                self.stdout.write(
+                    f'  {name}: медиана {median(medians):.2f} мс, '
+                    f'худший запрос {max(medians):.2f} мс, '
+                    f'максимум {max(worst):.2f} мс'
+                )
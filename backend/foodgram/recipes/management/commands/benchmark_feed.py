@@ -0,0 +1,175 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.paginations import RecipeCursorPagination
+from api.views import CustomUserViewSet
+from recipes.benchmarks import timings
+from recipes.feed import fan_out, feed_keys
+from recipes.fixtures import (
+    bulk_create,
+    seed_follows,
+    seed_recipes,
+    seed_users
+)
+from recipes.models import FeedItem, Recipe
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Замер ленты подписок: время чтения первой и последней страницы '
+        'в сравнении с соединением Follow -> Recipe и стоимость рассылки '
+        'одного рецепта подписчикам. Данные генерируются в транзакции и '
+        'откатываются после замера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--authors',
+            type=int,
+            default=200,
+            help='Авторов в подписках читателя',
+        )
+        parser.add_argument(
+            '--popular',
+            type=int,
+            default=2,
+            help='Популярных авторов в подписках, их рецепты не рассылаются',
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=50,
+            help='Рецептов у каждого автора',
+        )
+        parser.add_argument(
+            '--followers',
+            type=int,
+            nargs='+',
+            default=[100, 1000, 10000],
+            help='Числа подписчиков для замера рассылки',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=6,
+            help='Размер страницы',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Число повторов каждого замера',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.benchmark_read(options)
+            self.benchmark_write(options)
+            transaction.set_rollback(True)
+
+    def report(self, name, func, repeat):
+        median, worst = timings(func, repeat)
+        self.stdout.write(
+            f'{name}: {median:.1f} мс (максимум {worst:.1f} мс)'
+        )
+
+    def benchmark_read(self, options):
+        recipes = options['recipes']
+        reader = User.objects.get(pk=seed_users(1, 'bench-reader')[0])
+        authors = seed_users(options['authors'], 'bench-author')
+        popular = seed_users(options['popular'], 'bench-popular')
+        seed_recipes(authors, len(authors) * recipes)
+        seed_recipes(popular, len(popular) * recipes, fanned_out=False)
+        seed_follows([reader.pk], authors + popular)
+        bulk_create(FeedItem, (
+            FeedItem(user=reader, recipe_id=recipe_id, pub_date=pub_date)
+            for recipe_id, pub_date in Recipe.objects.filter(
+                author_id__in=authors
+            ).values_list('pk', 'pub_date').iterator()
+        ))
+        total = (len(authors) + len(popular)) * recipes
+        limit = options['limit']
+        self.stdout.write(
+            f'Лента: {len(authors)} авторов и {len(popular)} популярных '
+            f'по {recipes} рецептов, всего {total}, страница {limit}'
+        )
+        following = Recipe.objects.filter(
+            author__in=Follow.objects.filter(user=reader).values('author_id')
+        ).order_by('-pub_date', '-id')
+        last = following[max(total - limit - 1, 0)]
+        paginator = RecipeCursorPagination()
+        paginator.base_url = ''
+        last_page = paginator.encode_cursor(last, reverse=False)
+        view = CustomUserViewSet.as_view(
+            {'get': 'feed'}, **CustomUserViewSet.feed.kwargs
+        )
+        factory = APIRequestFactory()
+
+        def read(query):
+            request = factory.get(f'/api/users/feed/{query}')
+            force_authenticate(request, user=reader)
+            return view(request).render()
+
+        def inbox_keys(query):
+            paginator = RecipeCursorPagination()
+            paginator.prepare(Request(factory.get(f'/api/users/feed/{query}')))
+            return sorted(
+                feed_keys(reader, paginator.seek), reverse=True
+            )[:limit]
+
+        def join_keys(offset):
+            return list(
+                following.values_list('pk', flat=True)[offset:offset + limit]
+            )
+
+        repeat = options['repeat']
+        pages = (
+            ('первая', f'?limit={limit}', 0),
+            ('последняя', f'{last_page}&limit={limit}', total - limit),
+        )
+        for page, query, offset in pages:
+            self.report(
+                f'Ключи из входящих, {page} страница',
+                partial(inbox_keys, query),
+                repeat,
+            )
+            self.report(
+                f'Ключи соединением Follow -> Recipe, {page} страница',
+                partial(join_keys, offset),
+                repeat,
+            )
+            self.report(
+                f'GET /api/users/feed/, {page} страница',
+                partial(read, query),
+                repeat,
+            )
+
+    def benchmark_write(self, options):
+        pool = seed_users(max(options['followers']), 'bench-follower')
+        for followers in options['followers']:
+            author = seed_users(1, f'bench-fan-out-{followers}-')
+            seed_follows(pool[:followers], author)
+            recipe_ids = iter(seed_recipes(
+                author, options['repeat'], fanned_out=False
+            ))
+            if followers > settings.FEED_FANOUT_MAX_FOLLOWERS:
+                self.stdout.write(
+                    f'Рассылка {followers} подписчикам: автор популярный, '
+                    f'рецепт читается при запросе'
+                )
+                continue
+            median, worst = timings(
+                lambda: fan_out(next(recipe_ids)), options['repeat']
+            )
+            self.stdout.write(
+                f'Рассылка рецепта {followers} подписчикам: '
+                f'{median:.1f} мс (максимум {worst:.1f} мс), '
+                f'{median * 1000 / followers:.1f} мкс на подписчика'
+            )
@@ -0,0 +1,113 @@
+from functools import partial
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.paginations import RecipeCursorPagination
+from api.views import RecipeViewSet
+from recipes.benchmarks import timings
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Сравнение постраничной пагинации (OFFSET) и keyset пагинации по '
+        'курсору ленты рецептов на первой и глубокой странице. Нужна '
+        'большая база, например из generate_recipes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page',
+            type=int,
+            default=10000,
+            help='Номер глубокой страницы',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=6,
+            help='Размер страницы',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            help='Число повторов каждого замера',
+        )
+
+    def report(self, name, func, repeat):
+        median, worst = timings(func, repeat)
+        self.stdout.write(
+            f'{name}: {median:.1f} мс (максимум {worst:.1f} мс)'
+        )
+
+    def handle(self, *args, **options):
+        page, limit, repeat = (
+            options['page'], options['limit'], options['repeat']
+        )
+        total = Recipe.objects.count()
+        if total < page * limit:
+            raise CommandError(
+                f'Рецептов {total}, для страницы {page} нужно не меньше '
+                f'{page * limit}: сгенерируйте их командой generate_recipes'
+            )
+        self.stdout.write(f'Рецептов {total}, страница {limit}')
+        ordered = Recipe.objects.order_by('-pub_date', '-id')
+        paginator = RecipeCursorPagination()
+        paginator.base_url = ''
+        deep_cursor = paginator.encode_cursor(
+            ordered[(page - 1) * limit - 1], reverse=False
+        )
+        factory = APIRequestFactory()
+        view = RecipeViewSet.as_view({'get': 'list'})
+        cache.clear()
+
+        def read(query):
+            return view(factory.get(f'/api/recipes/{query}')).render()
+
+        def offset_keys(offset):
+            return list(
+                ordered.values_list('pk', flat=True)[offset:offset + limit]
+            )
+
+        def cursor_keys(query):
+            paginator = RecipeCursorPagination()
+            paginator.prepare(Request(factory.get(f'/api/recipes/{query}')))
+            return list(paginator.seek(
+                Recipe.objects.values_list('pk', flat=True)
+            ))
+
+        self.report(
+            'COUNT рецептов, кешируется постраничной пагинацией',
+            Recipe.objects.count,
+            repeat,
+        )
+        pages = (
+            (1, '?pagination=cursor'),
+            (page, deep_cursor),
+        )
+        for number, cursor in pages:
+            self.report(
+                f'Ключи через OFFSET, страница {number}',
+                partial(offset_keys, (number - 1) * limit),
+                repeat,
+            )
+            self.report(
+                f'Ключи по курсору, страница {number}',
+                partial(cursor_keys, f'{cursor}&limit={limit}'),
+                repeat,
+            )
+            self.report(
+                f'GET /api/recipes/?page={number}',
+                partial(read, f'?page={number}&limit={limit}'),
+                repeat,
+            )
+            self.report(
+                f'GET /api/recipes/ с курсором, страница {number}',
+                partial(read, f'{cursor}&limit={limit}'),
+                repeat,
+            )
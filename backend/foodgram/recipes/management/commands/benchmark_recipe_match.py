@@ -0,0 +1,127 @@
+from functools import partial
+from random import Random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.benchmarks import MIB, peak_memory, timings
+from recipes.fixtures import seed_ingredients, seed_recipes, seed_users
+from recipes.matching import RecipeMatcher
+from recipes.models import Recipe
+
+
+def match_db(ingredient_ids, max_missing):
+    return list(RecipeMatcher._match_db(ingredient_ids, max_missing))
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Замер поиска рецептов по ингредиентам: сборка индекса битовых '
+        'карт, его память и время поиска по индексу в сравнении с '
+        'группировкой в БД. Данные генерируются в транзакции и '
+        'откатываются после замера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=100000,
+            help='Число генерируемых рецептов',
+        )
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=2000,
+            help='Число генерируемых ингредиентов',
+        )
+        parser.add_argument(
+            '--per-recipe',
+            type=int,
+            default=8,
+            help='Ингредиентов в каждом рецепте',
+        )
+        parser.add_argument(
+            '--query',
+            type=int,
+            nargs='+',
+            default=[3, 10, 30],
+            help='Числа ингредиентов в запросе',
+        )
+        parser.add_argument(
+            '--max-missing',
+            type=int,
+            help='Допустимое число недостающих ингредиентов',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            help='Число повторов каждого замера',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def report(self, name, func, repeat):
+        median, worst = timings(func, repeat)
+        self.stdout.write(
+            f'{name}: {median:.1f} мс (максимум {worst:.1f} мс)'
+        )
+
+    def benchmark(self, options):
+        ingredient_ids = seed_ingredients(options['ingredients'], 'bench')
+        seed_recipes(
+            seed_users(10, 'bench-match'),
+            options['recipes'],
+            ingredient_ids,
+            per_recipe=options['per_recipe'],
+            prefix='bench',
+        )
+        total = Recipe.objects.count()
+        if total > settings.RECIPE_MATCH_INDEX_MAX_SIZE:
+            raise CommandError(
+                'Рецептов больше RECIPE_MATCH_INDEX_MAX_SIZE, индекс не '
+                'собирается, уменьшите --recipes'
+            )
+        self.stdout.write(
+            f'Рецептов {total}, ингредиентов {len(ingredient_ids)} '
+            f'по {options["per_recipe"]} в рецепте'
+        )
+        repeat = options['repeat']
+        self.report(
+            'Сборка индекса', RecipeMatcher._build_index, min(repeat, 3)
+        )
+        python_peak, rss_peak = peak_memory(RecipeMatcher._build_index)
+        rss = 'н/д' if rss_peak is None else f'{rss_peak / MIB:.1f} МиБ'
+        self.stdout.write(
+            f'Память сборки: пик Python {python_peak / MIB:.1f} МиБ, '
+            f'пик RSS {rss}'
+        )
+        index = RecipeMatcher._build_index()
+        bitmaps_size = sum(
+            bitmap.bit_length() // 8 for bitmap in index[0].values()
+        )
+        self.stdout.write(
+            f'Битовые карты {len(index[0])} ингредиентов: '
+            f'{bitmaps_size / MIB:.1f} МиБ'
+        )
+        random = Random(0)
+        max_missing = options['max_missing']
+        for size in options['query']:
+            query = random.sample(ingredient_ids, size)
+            by_index = partial(
+                RecipeMatcher._match_index, index, query, max_missing
+            )
+            by_db = partial(match_db, query, max_missing)
+            matches = by_index()
+            self.stdout.write(
+                f'Запрос из {size} ингредиентов: найдено {len(matches)}, '
+                f'результаты {"совпадают" if matches == by_db() else "РАЗНЫЕ"}'
+            )
+            self.report('  индекс', by_index, repeat)
+            self.report('  БД', by_db, repeat)
@@ -0,0 +1,148 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import RecipeViewSet
+from recipes.benchmarks import MIB, peak_memory, timings
+from recipes.fixtures import (
+    bulk_create,
+    seed_ingredients,
+    seed_recipes,
+    seed_users
+)
+from recipes.models import RecipeIngredient, ShoppingCartItem, ShoppingList
+from users.models import User
+
+
+def legacy_export(user):
+    """Прежняя выгрузка: агрегат по рецептам собирается в список строк"""
+    ingredients = RecipeIngredient.objects.filter(
+        recipe__shoppinglist_recipe__user=user
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(ingredient_amount=Sum('amount'))
+    shopping_list = ['Список покупок:\n']
+    for ingredient in ingredients:
+        name = ingredient['ingredient__name']
+        unit = ingredient['ingredient__measurement_unit']
+        amount = ingredient['ingredient_amount']
+        shopping_list.append(f'\n{name} - {amount}, {unit}')
+    response = HttpResponse(shopping_list, content_type='text/plain')
+    return len(response.content)
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Сравнение памяти и времени потоковой выгрузки списка покупок с '
+        'прежней выгрузкой, собиравшей файл в памяти. Данные генерируются '
+        'в транзакции и откатываются после замера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=50000,
+            help='Число разных ингредиентов в списке покупок',
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=5000,
+            help='Число рецептов в списке покупок',
+        )
+        parser.add_argument(
+            '--per-recipe',
+            type=int,
+            default=10,
+            help='Ингредиентов в каждом рецепте',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('txt', 'csv', 'pdf'),
+            default='txt',
+            help='Формат потоковой выгрузки, прежняя была только в txt',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Число повторов для замера времени',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, options):
+        user = User.objects.get(pk=seed_users(1, 'bench-cart')[0])
+        ingredient_ids = seed_ingredients(options['ingredients'], 'bench-cart')
+        recipe_ids = seed_recipes(
+            [user.pk], options['recipes'], prefix='bench-cart'
+        )
+        per_recipe = options['per_recipe']
+        bulk_create(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_ids[
+                    (number * per_recipe + shift) % len(ingredient_ids)
+                ],
+                amount=shift + 1,
+            )
+            for number, recipe_id in enumerate(recipe_ids)
+            for shift in range(per_recipe)
+        ))
+        bulk_create(ShoppingList, (
+            ShoppingList(user=user, recipe_id=recipe_id)
+            for recipe_id in recipe_ids
+        ))
+        bulk_create(ShoppingCartItem, (
+            ShoppingCartItem(
+                user=user, ingredient_id=ingredient_id, total_amount=total
+            )
+            for ingredient_id, total in RecipeIngredient.objects.filter(
+                recipe_id__in=ShoppingList.objects.filter(
+                    user=user
+                ).values('recipe_id')
+            ).values_list('ingredient_id').annotate(
+                total=Sum('amount')
+            ).order_by().iterator()
+        ))
+        rows = ShoppingCartItem.objects.filter(user=user).count()
+        self.stdout.write(
+            f'Список покупок: {len(recipe_ids)} рецептов, {rows} строк'
+        )
+        view = RecipeViewSet.as_view(
+            {'get': 'download_shopping_cart'},
+            **RecipeViewSet.download_shopping_cart.kwargs
+        )
+        factory = APIRequestFactory()
+        path = (
+            f'/api/recipes/download_shopping_cart/?format={options["format"]}'
+        )
+
+        def streaming_export():
+            request = factory.get(path)
+            force_authenticate(request, user=user)
+            return sum(
+                len(chunk) for chunk in view(request).streaming_content
+            )
+
+        exports = (
+            ('Прежняя выгрузка в памяти, txt', lambda: legacy_export(user)),
+            (f'Потоковая выгрузка, {options["format"]}', streaming_export),
+        )
+        for name, export in exports:
+            size = export()
+            python_peak, rss_peak = peak_memory(export)
+            median, worst = timings(export, options['repeat'])
+            rss = 'н/д' if rss_peak is None else f'{rss_peak / MIB:.1f} МиБ'
+            self.stdout.write(
+                f'{name}: файл {size / MIB:.1f} МиБ, пик Python '
+                f'{python_peak / MIB:.1f} МиБ, пик RSS {rss}, время '
+                f'{median:.0f} мс (максимум {worst:.0f} мс)'
+            )
@@ -0,0 +1,115 @@
+import base64
+import json
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import BOUNDARY, encode_multipart, MULTIPART_CONTENT
+from PIL import Image
+from rest_framework.request import Request
+
+from api.parsers import LimitedJSONParser, StreamingMultiPartParser
+from api.serializers import RecipeImageField
+from recipes.benchmarks import MIB, peak_memory, timings
+
+MODES = ('base64', 'multipart')
+
+
+def noise_jpeg(side):
+    """JPEG из случайных пикселей: шум почти не сжимается"""
+    image = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Сравнение памяти и времени загрузки фото рецепта строкой Base64 в '
+        'JSON и файлом в multipart/form-data: разбор тела запроса и '
+        'проверка фото полем image, без записи в хранилище и БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--side',
+            type=int,
+            default=2000,
+            help='Сторона квадратного фото в пикселях',
+        )
+        parser.add_argument(
+            '--mode',
+            choices=MODES,
+            action='append',
+            help='Режим загрузки, по умолчанию оба',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Число повторов для замера времени',
+        )
+
+    def handle(self, *args, **options):
+        photo = noise_jpeg(options['side'])
+        self.stdout.write(
+            f'Фото {options["side"]}x{options["side"]}, '
+            f'{len(photo) / MIB:.1f} МиБ'
+        )
+        if len(photo) > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise CommandError(
+                'Фото больше RECIPE_IMAGE_MAX_SIZE, уменьшите --side'
+            )
+        for mode in options['mode'] or MODES:
+            upload = self.make_upload(mode, photo)
+            python_peak, rss_peak = peak_memory(upload)
+            median, worst = timings(upload, options['repeat'])
+            rss = 'н/д' if rss_peak is None else f'{rss_peak / MIB:.1f} МиБ'
+            self.stdout.write(
+                f'{mode}: пик Python {python_peak / MIB:.1f} МиБ, '
+                f'пик RSS {rss}, время {median:.0f} мс '
+                f'(максимум {worst:.0f} мс)'
+            )
+
+    @staticmethod
+    def make_upload(mode, photo):
+        """Функция, которая разбирает запрос с фото и проверяет фото.
+
+        Тело запроса готовится заранее и в замер не входит, как и
+        буфер сокета у настоящего сервера.
+        """
+        if mode == 'base64':
+            encoded = base64.b64encode(photo).decode()
+            content_type = 'application/json'
+            body = json.dumps(
+                {'image': f'data:image/jpeg;base64,{encoded}'}
+            ).encode()
+        else:
+            file = BytesIO(photo)
+            file.name = 'photo.jpg'
+            content_type = f'{MULTIPART_CONTENT}; boundary={BOUNDARY}'
+            body = encode_multipart(BOUNDARY, {'data': '{}', 'image': file})
+
+        def upload():
+            request = Request(
+                WSGIRequest({
+                    'REQUEST_METHOD': 'POST',
+                    'PATH_INFO': '/api/recipes/',
+                    'CONTENT_TYPE': content_type,
+                    'CONTENT_LENGTH': str(len(body)),
+                    'SERVER_NAME': 'localhost',
+                    'SERVER_PORT': '80',
+                    'wsgi.input': BytesIO(body),
+                    'wsgi.url_scheme': 'http',
+                }),
+                parsers=[LimitedJSONParser(), StreamingMultiPartParser()],
+            )
+            try:
+                RecipeImageField().run_validation(request.data['image'])
+            finally:
+                request._request.close()
+
+        return upload
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+
+    help = 'Генерация уменьшенных копий фото рецептов (thumbnail, card, full)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Заново закодировать варианты всех фото, в том числе '
+                 'уже готовые файлы',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        built = skipped = 0
+        for recipe_id in recipes.values_list('pk', flat=True).iterator():
+            if build_variants(recipe_id, force=options['all']):
+                built += 1
+            else:
+                skipped += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово! Обработано фото: {built}, пропущено: {skipped}'
+        ))
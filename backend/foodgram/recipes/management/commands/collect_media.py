@@ -0,0 +1,98 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.media import recount_refs
+from recipes.models import MediaFile
+
+MEDIA_DIR = 'recipes'
+
+
+def walk(storage, directory):
+    """Все файлы каталога хранилища рекурсивно"""
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}'
+    for name in directories:
+        yield from walk(storage, f'{directory}/{name}')
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Удаление фото рецептов и их вариантов, на которые не осталось '
+        'ссылок, и файлов, не учтенных в счетчиках'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=settings.MEDIA_GC_GRACE,
+            help='Не удалять файлы, которые менялись за последние N секунд',
+        )
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help='Сначала пересчитать счетчики ссылок по рецептам',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать файлы, которые будут удалены',
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write(f'Исправлено счетчиков: {recount_refs()}')
+        self.dry_run = options['dry_run']
+        self.cutoff = timezone.now() - timedelta(seconds=options['grace'])
+        deleted = self.collect_released() + self.collect_untracked()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово! Удалено файлов: {deleted}'
+        ))
+
+    def is_recent(self, name):
+        try:
+            return default_storage.get_modified_time(name) > self.cutoff
+        except FileNotFoundError:
+            return False
+
+    def delete(self, name):
+        self.stdout.write(name)
+        if not self.dry_run:
+            default_storage.delete(name)
+
+    def collect_released(self):
+        """Файлы со счетчиком ноль, строка удаляется до файла"""
+        deleted = 0
+        for media in MediaFile.objects.filter(
+            refcount=0, updated__lt=self.cutoff
+        ).iterator():
+            if self.is_recent(media.name):
+                continue
+            if not self.dry_run:
+                removed, _ = MediaFile.objects.filter(
+                    pk=media.pk, refcount=0
+                ).delete()
+                if not removed:
+                    continue
+            self.delete(media.name)
+            deleted += 1
+        return deleted
+
+    def collect_untracked(self):
+        """Файлы без строки в MediaFile: незавершенные загрузки и старые"""
+        if not default_storage.exists(MEDIA_DIR):
+            return 0
+        tracked = set(MediaFile.objects.values_list('name', flat=True))
+        deleted = 0
+        for name in walk(default_storage, MEDIA_DIR):
+            if name in tracked or self.is_recent(name):
+                continue
+            self.delete(name)
+            deleted += 1
+        return deleted
@@ -0,0 +1,199 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.paginations import explain_plan
+from recipes.fixtures import (
+    bulk_create,
+    seed_ingredients,
+    seed_recipes,
+    seed_users
+)
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeScore,
+    ShoppingCartItem,
+    ShoppingList
+)
+from recipes.trending import refresh_trending
+from users.models import Follow, User
+
+CHECKED_TABLES = {
+    model._meta.db_table for model in (
+        Favorite, Follow, Ingredient, Recipe, RecipeIngredient, RecipeScore,
+        ShoppingCartItem, ShoppingList,
+    )
+}
+
+
+def hot_queries():
+    """Запросы горячих путей API в виде (название, queryset)"""
+    user_id = User.objects.values_list('id', flat=True).first() or 0
+    recipe_id = Recipe.objects.values_list('id', flat=True).first() or 0
+    return (
+        ('лента рецептов', Recipe.objects.order_by('-pub_date', '-id')[:6]),
+        (
+            'популярные рецепты',
+            Recipe.objects.order_by('-favorites_count', '-id')[:6]
+        ),
+        (
+            'набирающие популярность',
+            Recipe.objects.filter(
+                score__isnull=False
+            ).order_by('-score__score', '-id')[:6]
+        ),
+        (
+            'рецепты автора',
+            Recipe.objects.filter(author_id=user_id).order_by('-pub_date')[:6]
+        ),
+        (
+            'ингредиенты рецепта',
+            RecipeIngredient.objects.filter(recipe_id=recipe_id)
+        ),
+        (
+            'в избранном',
+            Favorite.objects.filter(user_id=user_id, recipe_id=recipe_id)
+        ),
+        (
+            'избранное пользователя',
+            Favorite.objects.filter(user_id=user_id).values('recipe_id')
+        ),
+        (
+            'рецепт в списках покупок',
+            ShoppingList.objects.filter(recipe_id=recipe_id).values('user_id')
+        ),
+        (
+            'итоги списка покупок',
+            ShoppingCartItem.objects.filter(user_id=user_id)
+        ),
+        (
+            'подписки пользователя',
+            Follow.objects.filter(user_id=user_id).values('author_id')
+        ),
+        (
+            'подписчики автора',
+            Follow.objects.filter(author_id=user_id).values('user_id')
+        ),
+        (
+            'ингредиенты по началу названия',
+            Ingredient.objects.filter(name__istartswith='сол')[:20]
+        ),
+        (
+            'ингредиенты по подстроке',
+            Ingredient.objects.filter(name__icontains='оло')[:20]
+        ),
+    )
+
+
+def seq_scans(plan):
+    """Таблицы из CHECKED_TABLES, которые план читает полным сканированием"""
+    tables = set()
+    if (
+        plan.get('Node Type') == 'Seq Scan'
+        and plan.get('Relation Name') in CHECKED_TABLES
+    ):
+        tables.add(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        tables |= seq_scans(child)
+    return tables
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Проверка планов (EXPLAIN) горячих запросов: ошибка, если какой-то '
+        'из них читает большую таблицу полным сканированием. Только PostgreSQL'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Сгенерировать столько рецептов перед проверкой, '
+                 'данные откатываются после проверки. На маленькой базе '
+                 'планировщик законно выбирает Seq Scan',
+        )
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Печатать планы целиком',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN проверяется только на PostgreSQL')
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            failures = self.explain(options['verbose_plans'])
+            transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                'Полное сканирование в запросах: ' + ', '.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS('Все запросы используют индексы'))
+
+    def seed(self, recipes):
+        users = max(recipes // 20, 2)
+        ingredients = max(recipes // 10, 100)
+        self.stdout.write(
+            f'Генерируем {recipes} рецептов, {users} пользователей, '
+            f'{ingredients} ингредиентов...'
+        )
+        user_ids = seed_users(users, 'explain')
+        ingredient_ids = seed_ingredients(ingredients, 'explain')
+        recipe_ids = seed_recipes(
+            user_ids, recipes, ingredient_ids, prefix='explain'
+        )
+        for model in (Favorite, ShoppingList):
+            bulk_create(model, (
+                model(
+                    user_id=user_id,
+                    recipe_id=recipe_ids[
+                        (number * 7 + shift) % len(recipe_ids)
+                    ],
+                )
+                for number, user_id in enumerate(user_ids)
+                for shift in range(10)
+            ))
+        bulk_create(Follow, (
+            Follow(
+                user_id=user_id,
+                author_id=user_ids[(number + shift) % len(user_ids)],
+            )
+            for number, user_id in enumerate(user_ids)
+            for shift in range(1, min(10, len(user_ids)))
+        ))
+        bulk_create(ShoppingCartItem, (
+            ShoppingCartItem(
+                user_id=user_id,
+                ingredient_id=ingredient_ids[
+                    (number * 7 + shift) % len(ingredient_ids)
+                ],
+                total_amount=shift + 1,
+            )
+            for number, user_id in enumerate(user_ids)
+            for shift in range(10)
+        ))
+        refresh_trending(full=True)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain(self, verbose_plans):
+        failures = []
+        for name, queryset in hot_queries():
+            plan = explain_plan(queryset)
+            tables = seq_scans(plan)
+            if tables:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: Seq Scan по {", ".join(sorted(tables))}'
+                ))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if verbose_plans:
+                self.stdout.write(str(plan))
+        return failures
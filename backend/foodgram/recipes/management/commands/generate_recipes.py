@@ -0,0 +1,74 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.fixtures import seed_ingredients, seed_recipes, seed_users
+from recipes.models import Ingredient
+from users.models import User
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Генерация тестовых рецептов для замеров на большой базе, например '
+        'benchmark_pagination. Данные сохраняются, повторный запуск '
+        'добавляет рецепты тем же авторам'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=1000000,
+            help='Число генерируемых рецептов',
+        )
+        parser.add_argument(
+            '--authors',
+            type=int,
+            default=1000,
+            help='Число авторов, рецепты распределяются по ним по кругу',
+        )
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=2000,
+            help='Число ингредиентов',
+        )
+        parser.add_argument(
+            '--per-recipe',
+            type=int,
+            default=5,
+            help='Ингредиентов в каждом рецепте',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='gen',
+            help='Префикс имен пользователей, ингредиентов и рецептов',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        seed_users(options['authors'], prefix)
+        seed_ingredients(options['ingredients'], prefix)
+        author_ids = list(User.objects.filter(
+            username__startswith=prefix, email__endswith='@example.com'
+        ).values_list('pk', flat=True))
+        ingredient_ids = list(Ingredient.objects.filter(
+            name__startswith=f'{prefix} '
+        ).values_list('pk', flat=True))
+        self.stdout.write(
+            f'Генерируем {options["recipes"]} рецептов для '
+            f'{len(author_ids)} авторов...'
+        )
+        recipe_ids = seed_recipes(
+            author_ids,
+            options['recipes'],
+            ingredient_ids,
+            per_recipe=options['per_recipe'],
+            prefix=prefix,
+        )
+        call_command('reconcile_counters', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано рецептов: {len(recipe_ids)}'
+        ))
@@ -1,31 +1,175 @@
-from csv import reader
+import csv
+import json
+import os
+import re
+from io import StringIO
+from itertools import islice
+from time import monotonic
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from api.caching import bump_table_version
+from recipes.autocomplete import ingredient_autocomplete
 from recipes.models import Ingredient
 
+DEFAULT_PATH = os.path.join(
+    settings.BASE_DIR, 'recipes', 'data', 'ingredients.csv'
+)
+READ_SIZE = 64 * 1024
+JSON_SEPARATORS = re.compile(r'[\s,]*')
 
-IMPORT_OBJECTS = [
-    (Ingredient, 'ingredients.csv'),
-]
+
+def read_csv(file):
+    """Строки (название, единица измерения) из csv файла"""
+    for row in csv.reader(file):
+        if row:
+            name, measurement_unit = row
+            yield name.strip(), measurement_unit.strip()
+
+
+def read_json(file):
+    """Строки (название, единица измерения) из json массива объектов.
+
+    Файл читается частями, объекты разбираются по одному, поэтому весь
+    массив в память не загружается.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидался json массив объектов')
+    position = 1
+    chunk = buffer
+    while chunk:
+        position = JSON_SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_SIZE)
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'].strip(), item['measurement_unit'].strip()
+    raise CommandError('Некорректный json файл')
+
+
+class RowsFile:
+    """Файлоподобный объект с csv представлением строк для COPY"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = ''
+
+    def read(self, size=-1):
+        output = StringIO()
+        writer = csv.writer(output)
+        while size < 0 or len(self.buffer) + output.tell() < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            writer.writerow(row)
+        data = self.buffer + output.getvalue()
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
 
 
 class Command(BaseCommand):
 
-    help = 'Загрузка данных из файлов csv в таблицы бд через модели'
+    help = (
+        'Загрузка ингредиентов из csv или json файла без удаления '
+        'существующих: новые строки добавляются, совпадающие пропускаются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=DEFAULT_PATH,
+            help='Путь к файлу ingredients.csv или ingredients.json',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одной пачке bulk_create',
+        )
+        parser.add_argument(
+            '--method',
+            choices=('auto', 'bulk', 'copy'),
+            default='auto',
+            help='bulk_create пачками или COPY через временную таблицу '
+                 '(только PostgreSQL), auto выбирает COPY на PostgreSQL',
+        )
 
     def handle(self, *args, **options):
+        path = options['path']
+        method = options['method']
+        if method == 'auto':
+            method = 'copy' if connection.vendor == 'postgresql' else 'bulk'
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('COPY доступен только для PostgreSQL')
+        readers = {'.csv': read_csv, '.json': read_json}
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in readers:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        self.stdout.write(f'Загружаем {path} ({method})...')
+        self.total = 0
+        started = monotonic()
+        with open(path, encoding='utf-8') as file:
+            rows = self.count_rows(readers[extension](file))
+            if method == 'copy':
+                created = self.load_copy(rows)
+            else:
+                created = self.load_bulk(rows, options['chunk_size'])
+        elapsed = max(monotonic() - started, 1e-6)
+        ingredient_autocomplete.invalidate()
+        bump_table_version(Ingredient)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово! Прочитано {self.total}, добавлено {created}, '
+            f'{elapsed:.2f} с, {self.total / elapsed:.0f} строк/с'
+        ))
+
+    def count_rows(self, rows):
+        for row in rows:
+            self.total += 1
+            yield row
+
+    @staticmethod
+    def load_bulk(rows, chunk_size):
+        before = Ingredient.objects.count()
+        for chunk in iter(lambda: set(islice(rows, chunk_size)), set()):
+            Ingredient.objects.bulk_create(
+                [
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in chunk
+                ],
+                ignore_conflicts=True,
+            )
+        return Ingredient.objects.count() - before
 
-        for model, filename in IMPORT_OBJECTS:
-            model_obj = model.objects.all()
-            model_obj.delete()
-            print(f'Загружаем {filename}...')
-            with open(f'recipes/data/{filename}', 'r') as open_file:
-                file_reader = reader(open_file)
-                for row in file_reader:
-                    name, measurement_unit = row
-                    Ingredient.objects.get_or_create(
-                        name=name,
-                        measurement_unit=measurement_unit
-                    )
-        print('Готово!')
+    @staticmethod
+    @transaction.atomic
+    def load_copy(rows):
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_staging '
+                '(name text, measurement_unit text) ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_staging (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                RowsFile(rows),
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT name, measurement_unit '
+                f'FROM ingredient_staging '
+                f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return cursor.rowcount
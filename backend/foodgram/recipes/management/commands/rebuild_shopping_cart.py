@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingCartItem
+
+BATCH_SIZE = 1000
+
+
+def live_totals():
+    """Итоги списков покупок, посчитанные агрегацией по рецептам"""
+    return RecipeIngredient.objects.filter(
+        recipe__shoppinglist_recipe__isnull=False
+    ).values_list(
+        'recipe__shoppinglist_recipe__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+
+
+class Command(BaseCommand):
+
+    help = 'Пересборка и проверка итогов списков покупок ShoppingCartItem'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить таблицу с агрегатом, без пересборки',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            self.check_totals()
+        else:
+            self.rebuild_totals()
+
+    def check_totals(self):
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in live_totals().iterator()
+        }
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingCartItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            ).iterator()
+        }
+        mismatches = [
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        ]
+        for user_id, ingredient_id in mismatches:
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'ожидалось {expected.get((user_id, ingredient_id))}, '
+                f'в таблице {stored.get((user_id, ingredient_id))}'
+            )
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Расхождений нет, позиций: {len(stored)}'
+        ))
+
+    @transaction.atomic
+    def rebuild_totals(self):
+        ShoppingCartItem.objects.all().delete()
+        batch = []
+        created = 0
+        for user_id, ingredient_id, total in live_totals().iterator():
+            batch.append(ShoppingCartItem(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total
+            ))
+            if len(batch) >= BATCH_SIZE:
+                created += len(ShoppingCartItem.objects.bulk_create(batch))
+                batch = []
+        created += len(ShoppingCartItem.objects.bulk_create(batch))
+        self.stdout.write(self.style.SUCCESS(
+            f'Таблица пересобрана, позиций: {created}'
+        ))
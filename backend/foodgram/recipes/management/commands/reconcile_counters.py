@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingList
+from users.models import Follow, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_carts_count', ShoppingList, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+    (User, 'following_count', Follow, 'user'),
+)
+
+
+def live_count(related, related_field):
+    """Подзапрос с количеством связанных строк для OuterRef('pk')"""
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Сверка и исправление денормализованных счетчиков рецептов '
+        'и пользователей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счетчики, без исправления',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        total = 0
+        for model, field, related, related_field in COUNTERS:
+            count = live_count(related, related_field)
+            drifted = model.objects.exclude(**{field: count})
+            if options['check']:
+                changed = drifted.count()
+            else:
+                changed = drifted.update(**{field: count})
+            if changed:
+                self.stdout.write(
+                    f'{model._meta.label}.{field}: расхождений {changed}'
+                )
+            total += changed
+        if options['check'] and total:
+            raise CommandError(f'Расхождений: {total}')
+        if options['check']:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлено счетчиков: {total}'
+            ))
@@ -0,0 +1,29 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+
+from recipes.trending import refresh_trending
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Пересчет популярности рецептов для сортировки ordering=trending, '
+        'рассчитан на запуск по расписанию (cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Полный пересчет вместо добавления событий после '
+                 'предыдущего запуска',
+        )
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        updated = refresh_trending(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово! Обновлено рецептов: {updated}, '
+            f'{monotonic() - started:.2f} с'
+        ))
@@ -0,0 +1,243 @@
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Count,
+    Exists,
+    F,
+    FloatField,
+    OuterRef,
+    Q
+)
+from django.db.models.functions import Cast
+
+from .background import run_after_commit
+from .models import Recipe, RecipeIngredient
+
+BATCH_SIZE = 10000
+
+
+def bit_positions(bitmap):
+    """Номера установленных битов по возрастанию"""
+    bits = bin(bitmap)[:1:-1]
+    position = bits.find('1')
+    while position != -1:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+def from_positions(positions, size):
+    """Битовая карта из номеров битов, собирается за один проход"""
+    buffer = bytearray(size // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def coverage_key(match):
+    recipe_id, matched, missing = match
+    return (-matched / (matched + missing), missing, -recipe_id)
+
+
+class RecipeMatcher:
+    """Рецепты, которые можно приготовить из набора ингредиентов.
+
+    Результат - кортежи (id рецепта, найдено, не хватает) по убыванию
+    доли имеющихся ингредиентов, затем по числу недостающих. Индекс в
+    памяти процесса хранит для каждого ингредиента битовую карту id
+    рецептов и число ингредиентов каждого рецепта. Совпадения считаются
+    побитовым сложением карт запроса, без соединений в БД.
+
+    Сигналы после коммита помечают рецепты измененными, индекс
+    дополняется одним запросом при следующем поиске. Изменения из других
+    воркеров учитываются фоновой пересборкой не реже
+    RECIPE_MATCH_INDEX_TTL секунд. Если индекс отключен, еще не собран
+    или рецептов больше RECIPE_MATCH_INDEX_MAX_SIZE, поиск идет
+    группировкой по RecipeIngredient в БД.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+        self._built_at = 0
+        self._dirty = set()
+        self._building = False
+        self._changed_while_building = set()
+
+    def mark_dirty(self, recipe_ids):
+        """Обновление рецептов в индексе после коммита транзакции"""
+        recipe_ids = set(recipe_ids)
+
+        def mark():
+            with self._lock:
+                self._dirty |= recipe_ids
+                if self._building:
+                    self._changed_while_building |= recipe_ids
+
+        transaction.on_commit(mark)
+
+    def recipe_changed(self, sender, instance, **kwargs):
+        """Обработчик сигналов Recipe и RecipeIngredient"""
+        self.mark_dirty([getattr(instance, 'recipe_id', instance.pk)])
+
+    def match(self, ingredient_ids, max_missing=None):
+        ingredient_ids = set(ingredient_ids)
+        index = self._get_index()
+        if index is None:
+            return self._match_db(ingredient_ids, max_missing)
+        return self._match_index(index, ingredient_ids, max_missing)
+
+    def _get_index(self):
+        """Индекс с примененными изменениями или None для поиска в БД.
+
+        Устаревший индекс перестраивается в фоне, до готовности нового
+        используется старый, а до первой сборки - поиск в БД.
+        """
+        if not settings.RECIPE_MATCH_INDEX_ENABLED:
+            return None
+        if (
+            self._index is None
+            or monotonic() - self._built_at > settings.RECIPE_MATCH_INDEX_TTL
+        ):
+            self._schedule_rebuild()
+        if self._dirty:
+            with self._lock:
+                if self._index and self._dirty:
+                    self._index = self._update_index(self._index, self._dirty)
+                self._dirty = set()
+        return self._index or None
+
+    def _schedule_rebuild(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._changed_while_building = set()
+        run_after_commit(self._rebuild)
+
+    def _rebuild(self):
+        """Сборка индекса с повтором изменений, случившихся во время нее"""
+        try:
+            index = self._build_index()
+            with self._lock:
+                if index and self._changed_while_building:
+                    index = self._update_index(
+                        index, self._changed_while_building
+                    )
+                self._index = index
+                self._built_at = monotonic()
+                self._dirty = set()
+        finally:
+            self._building = False
+
+    @staticmethod
+    def _build_index():
+        """Битовые карты {ингредиент: рецепты} и {рецепт: ингредиентов}.
+
+        Пустой кортеж означает, что рецептов слишком много для памяти.
+        """
+        if Recipe.objects.count() > settings.RECIPE_MATCH_INDEX_MAX_SIZE:
+            return ()
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).order_by().iterator(chunk_size=BATCH_SIZE):
+            recipes[ingredient_id].add(recipe_id)
+        sizes = defaultdict(int)
+        for recipe_ids in recipes.values():
+            for recipe_id in recipe_ids:
+                sizes[recipe_id] += 1
+        size = max(sizes, default=0)
+        bitmaps = {
+            ingredient_id: from_positions(recipe_ids, size)
+            for ingredient_id, recipe_ids in recipes.items()
+        }
+        return bitmaps, dict(sizes)
+
+    @staticmethod
+    def _update_index(index, recipe_ids):
+        """Копия индекса с перечитанными из БД ингредиентами рецептов"""
+        bitmaps, sizes = dict(index[0]), dict(index[1])
+        mask = from_positions(recipe_ids, max(recipe_ids))
+        for ingredient_id, bitmap in index[0].items():
+            if bitmap & mask:
+                bitmap &= ~mask
+                if bitmap:
+                    bitmaps[ingredient_id] = bitmap
+                else:
+                    del bitmaps[ingredient_id]
+        for recipe_id in recipe_ids:
+            sizes.pop(recipe_id, None)
+        for recipe_id, ingredient_id in set(
+            RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('recipe_id', 'ingredient_id')
+        ):
+            bitmaps[ingredient_id] = bitmaps.get(ingredient_id, 0) | (
+                1 << recipe_id
+            )
+            sizes[recipe_id] = sizes.get(recipe_id, 0) + 1
+        return bitmaps, sizes
+
+    @staticmethod
+    def _match_index(index, ingredient_ids, max_missing):
+        """Подсчет совпадений сложением карт в двоичных разрядах.
+
+        planes[j] - карта рецептов, у которых в числе совпадений
+        установлен бит j: каждая карта запроса прибавляется к счетчикам
+        всех рецептов сразу, переносом между разрядами. Затем из разрядов
+        собирается карта рецептов с каждым возможным числом совпадений.
+        """
+        bitmaps, sizes = index
+        planes = []
+        for ingredient_id in ingredient_ids:
+            carry = bitmaps.get(ingredient_id, 0)
+            for digit, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[digit], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        candidates = reduce(or_, planes, 0)
+        matches = []
+        for matched in range(1, 1 << len(planes)):
+            recipes = candidates
+            for digit, plane in enumerate(planes):
+                recipes &= plane if matched >> digit & 1 else ~plane
+            for recipe_id in bit_positions(recipes):
+                missing = max(sizes.get(recipe_id, matched) - matched, 0)
+                if max_missing is None or missing <= max_missing:
+                    matches.append((recipe_id, matched, missing))
+        matches.sort(key=coverage_key)
+        return matches
+
+    @staticmethod
+    def _match_db(ingredient_ids, max_missing):
+        matches = Recipe.objects.filter(Exists(
+            RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk'), ingredient__in=ingredient_ids
+            )
+        )).annotate(
+            matched=Count(
+                'recipe_ingredients__ingredient',
+                filter=Q(recipe_ingredients__ingredient__in=ingredient_ids),
+                distinct=True,
+            ),
+            total=Count('recipe_ingredients__ingredient', distinct=True),
+        ).annotate(
+            missing=F('total') - F('matched'),
+            coverage=Cast('matched', FloatField()) / F('total'),
+        )
+        if max_missing is not None:
+            matches = matches.filter(missing__lte=max_missing)
+        return matches.order_by(
+            '-coverage', 'missing', '-id'
+        ).values_list('id', 'matched', 'missing')
+
+
+recipe_matcher = RecipeMatcher()
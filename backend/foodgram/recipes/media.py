@@ -0,0 +1,95 @@
+from collections import Counter
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import MediaFile, Recipe
+
+BATCH_SIZE = 1000
+
+
+def media_names(recipe):
+    """Файлы рецепта: фото и его варианты, None для отложенных полей.
+
+    Значения читаются из __dict__, чтобы не загружать отложенные поля
+    запросом при каждом создании экземпляра.
+    """
+    if {'image', 'image_variants'} & recipe.get_deferred_fields():
+        return None
+    image = recipe.__dict__['image']
+    names = {getattr(image, 'name', image)} - {None, ''}
+    return names | variant_names(recipe.__dict__['image_variants'])
+
+
+def variant_names(variants):
+    """Пути файлов из словаря вариантов {вариант: {формат: путь}}"""
+    return {
+        path
+        for formats in (variants or {}).values()
+        for path in formats.values()
+    }
+
+
+def change_refs(added=(), removed=()):
+    """Изменение счетчиков ссылок на файлы"""
+    added, removed = set(added) - set(removed), set(removed) - set(added)
+    now = timezone.now()
+    if added:
+        MediaFile.objects.bulk_create(
+            [MediaFile(name=name) for name in added],
+            ignore_conflicts=True,
+        )
+        MediaFile.objects.filter(name__in=added).update(
+            refcount=F('refcount') + 1, updated=now
+        )
+    if removed:
+        MediaFile.objects.filter(name__in=removed).update(
+            refcount=Greatest(F('refcount') - 1, 0), updated=now
+        )
+
+
+def remember_media(sender, instance, **kwargs):
+    instance._media_names = media_names(instance)
+
+
+def track_media(sender, instance, created=False, **kwargs):
+    """Обработчик post_save: ссылки на новые файлы и снятие старых"""
+    names = media_names(instance)
+    old_names = set() if created else getattr(instance, '_media_names', None)
+    if names is None or old_names is None:
+        return
+    change_refs(added=names - old_names, removed=old_names - names)
+    instance._media_names = names
+
+
+def release_media(sender, instance, **kwargs):
+    """Обработчик post_delete: снятие ссылок удаленного рецепта"""
+    names = media_names(instance) or getattr(instance, '_media_names', None)
+    if names:
+        change_refs(removed=names)
+
+
+def recount_refs():
+    """Пересчет счетчиков по рецептам, возвращает число исправлений"""
+    counts = Counter()
+    for recipe in Recipe.objects.only(
+        'image', 'image_variants'
+    ).iterator(chunk_size=BATCH_SIZE):
+        counts.update(media_names(recipe))
+    MediaFile.objects.bulk_create(
+        [MediaFile(name=name) for name in counts],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    now = timezone.now()
+    changed = []
+    for media in MediaFile.objects.iterator(chunk_size=BATCH_SIZE):
+        if media.refcount != counts.get(media.name, 0):
+            media.refcount = counts.get(media.name, 0)
+            media.updated = now
+            changed.append(media)
+    MediaFile.objects.bulk_update(
+        changed, ['refcount', 'updated'], batch_size=BATCH_SIZE
+    )
+    return len(changed)
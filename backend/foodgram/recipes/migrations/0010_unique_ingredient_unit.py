@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartItem = apps.get_model('recipes', 'ShoppingCartItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep_id=models.Min('id'), count=models.Count('id')
+    ).filter(count__gt=1).order_by()
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        extra_ids = list(Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=keep_id).values_list('id', flat=True))
+        RecipeIngredient.objects.filter(
+            ingredient_id__in=extra_ids
+        ).update(ingredient_id=keep_id)
+        for item in ShoppingCartItem.objects.filter(
+            ingredient_id__in=extra_ids
+        ):
+            kept, _ = ShoppingCartItem.objects.get_or_create(
+                user_id=item.user_id,
+                ingredient_id=keep_id,
+                defaults={'total_amount': 0},
+            )
+            kept.total_amount += item.total_amount
+            kept.save()
+            item.delete()
+        Ingredient.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_ingredient_name_trgm'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_unit'),
+        ),
+    ]
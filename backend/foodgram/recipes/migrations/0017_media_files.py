@@ -0,0 +1,59 @@
+# Generated by Django 3.2 on 2026-10-18 02:42
+
+from collections import Counter
+
+from django.db import migrations, models
+import recipes.storage
+
+
+def fill_media_files(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    MediaFile = apps.get_model('recipes', 'MediaFile')
+    counts = Counter()
+    for image, variants in Recipe.objects.values_list(
+        'image', 'image_variants'
+    ).iterator():
+        if image:
+            counts[image] += 1
+        for formats in (variants or {}).values():
+            counts.update(formats.values())
+    MediaFile.objects.bulk_create(
+        [
+            MediaFile(name=name, refcount=refcount)
+            for name, refcount in counts.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Путь в хранилище')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Дата изменения счетчика')),
+            ],
+            options={
+                'verbose_name': 'Файл хранилища',
+                'verbose_name_plural': 'Файлы хранилища',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Фото рецепта'),
+        ),
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(fields=['refcount', 'updated'], name='mediafile_refcount_idx'),
+        ),
+        migrations.RunPython(fill_media_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,142 @@
+# Generated by Django 3.2 on 2026-10-18 02:52
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+CREATE_SEARCH = '''
+CREATE OR REPLACE FUNCTION recipes_recipe_document(
+    recipe_id bigint, recipe_name text, recipe_text text
+) RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector(%(config)s, coalesce($2, '')), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce((
+            SELECT string_agg(i.name, ' ')
+            FROM recipes_recipeingredient ri
+            JOIN recipes_ingredient i ON i.id = ri.ingredient_id
+            WHERE ri.recipe_id = $1
+        ), '')), 'B')
+        || setweight(to_tsvector(%(config)s, coalesce($3, '')), 'C')
+$$;
+
+CREATE OR REPLACE FUNCTION recipes_recipe_search_vector()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := recipes_recipe_document(NEW.id, NEW.name, NEW.text);
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION recipes_recipeingredient_search_vector()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_LEVEL = 'ROW' THEN
+        UPDATE recipes_recipe SET search_vector = NULL
+        WHERE id IN (OLD.recipe_id, NEW.recipe_id);
+    ELSIF TG_OP = 'INSERT' THEN
+        UPDATE recipes_recipe SET search_vector = NULL
+        WHERE id IN (SELECT recipe_id FROM new_rows);
+    ELSE
+        UPDATE recipes_recipe SET search_vector = NULL
+        WHERE id IN (SELECT recipe_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION recipes_ingredient_search_vector()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE recipes_recipe SET search_vector = NULL
+    WHERE id IN (
+        SELECT recipe_id FROM recipes_recipeingredient
+        WHERE ingredient_id = NEW.id
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER recipes_recipe_search_vector
+BEFORE INSERT OR UPDATE OF name, text, search_vector ON recipes_recipe
+FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector();
+
+CREATE TRIGGER recipes_recipeingredient_search_insert
+AFTER INSERT ON recipes_recipeingredient
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_recipeingredient_search_vector();
+
+CREATE TRIGGER recipes_recipeingredient_search_delete
+AFTER DELETE ON recipes_recipeingredient
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_recipeingredient_search_vector();
+
+CREATE TRIGGER recipes_recipeingredient_search_update
+AFTER UPDATE OF recipe_id, ingredient_id ON recipes_recipeingredient
+FOR EACH ROW
+WHEN (OLD.recipe_id IS DISTINCT FROM NEW.recipe_id
+      OR OLD.ingredient_id IS DISTINCT FROM NEW.ingredient_id)
+EXECUTE FUNCTION recipes_recipeingredient_search_vector();
+
+CREATE TRIGGER recipes_ingredient_search_vector
+AFTER UPDATE OF name ON recipes_ingredient
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION recipes_ingredient_search_vector();
+
+UPDATE recipes_recipe SET search_vector = NULL;
+
+CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin
+ON recipes_recipe USING gin (search_vector);
+'''
+
+DROP_SEARCH = '''
+DROP INDEX IF EXISTS recipes_recipe_search_vector_gin;
+DROP TRIGGER IF EXISTS recipes_ingredient_search_vector
+    ON recipes_ingredient;
+DROP TRIGGER IF EXISTS recipes_recipeingredient_search_update
+    ON recipes_recipeingredient;
+DROP TRIGGER IF EXISTS recipes_recipeingredient_search_delete
+    ON recipes_recipeingredient;
+DROP TRIGGER IF EXISTS recipes_recipeingredient_search_insert
+    ON recipes_recipeingredient;
+DROP TRIGGER IF EXISTS recipes_recipe_search_vector ON recipes_recipe;
+DROP FUNCTION IF EXISTS recipes_ingredient_search_vector();
+DROP FUNCTION IF EXISTS recipes_recipeingredient_search_vector();
+DROP FUNCTION IF EXISTS recipes_recipe_search_vector();
+DROP FUNCTION IF EXISTS recipes_recipe_document(bigint, text, text);
+'''
+
+
+def create_search(apps, schema_editor):
+    """Поисковый документ поддерживается триггерами, только PostgreSQL.
+
+    Триггеры видят и bulk_create/bulk_update ингредиентов, которые не
+    отправляют сигналы Django.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        CREATE_SEARCH % {
+            'config': f"'{settings.SEARCH_CONFIG}'::regconfig"
+        }
+    )
+
+
+def drop_search(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_SEARCH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_media_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый документ'),
+        ),
+        migrations.RunPython(create_search, drop_search),
+    ]
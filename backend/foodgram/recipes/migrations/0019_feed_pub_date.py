@@ -0,0 +1,63 @@
+# Generated by Django 3.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def fill_feed(apps, schema_editor):
+    """Дата публикации во входящих и признак рассылки рецептов.
+
+    Разосланными считаются рецепты, которые уже есть во входящих, и
+    рецепты авторов без подписчиков. Остальные, в том числе рецепты
+    популярных авторов, лента читает из рецептов при запросе.
+    """
+    FeedItem = apps.get_model('recipes', 'FeedItem')
+    Follow = apps.get_model('users', 'Follow')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FeedItem.objects.update(pub_date=models.Subquery(
+        Recipe.objects.filter(
+            pk=models.OuterRef('recipe_id')
+        ).values('pub_date')[:1]
+    ))
+    Recipe.objects.filter(
+        models.Q(models.Exists(
+            FeedItem.objects.filter(recipe=models.OuterRef('pk'))
+        ))
+        | ~models.Q(models.Exists(
+            Follow.objects.filter(author=models.OuterRef('author_id'))
+        ))
+    ).update(fanned_out=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_recipe_search_vector'),
+        ('users', '0006_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fanned_out',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Разослан в ленты подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='feeditem',
+            name='pub_date',
+            field=models.DateTimeField(null=True, verbose_name='Дата публикации рецепта'),
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='feeditem',
+            name='pub_date',
+            field=models.DateTimeField(verbose_name='Дата публикации рецепта'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['author', '-pub_date', '-id'], name='recipe_feed_pull_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='feeditem_user_pub_date_idx'),
+        ),
+    ]
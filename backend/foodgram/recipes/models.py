@@ -1,9 +1,13 @@
-from django.db import models
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models
+from django.db.models import Case, F, Sum, Value, When
 
 from api.validators import validate_cooking_time, validate_count
 from users.models import User
 
+from .storage import media_storage
+
 
 class Ingredient(models.Model):
     """Модель игредиентов"""
@@ -17,6 +21,12 @@ class Ingredient(models.Model):
     )
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit'
+            )
+        ]
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
 
@@ -62,8 +72,15 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Фото рецепта',
         upload_to='recipes/',
+        storage=media_storage,
         blank=True,
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии фото',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -87,8 +104,47 @@ class Recipe(models.Model):
         verbose_name='Время приготовления',
         validators=[validate_cooking_time]
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    shopping_carts_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в список покупок',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый документ',
+        null=True,
+        editable=False,
+    )
+    fanned_out = models.BooleanField(
+        verbose_name='Разослан в ленты подписчиков',
+        default=False,
+        editable=False,
+    )
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                condition=models.Q(fanned_out=False),
+                name='recipe_feed_pull_idx'
+            ),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
@@ -118,6 +174,12 @@ class RecipeIngredient(models.Model):
     )
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=['recipe', 'ingredient', 'amount'],
+                name='recipeingredient_covering_idx'
+            ),
+        ]
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиенты рецепта'
 
@@ -139,6 +201,10 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Рецепт',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления',
+    )
 
     class Meta:
         constraints = [
@@ -147,6 +213,13 @@ class Favorite(models.Model):
                 name='unique_user_recipe'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'],
+                name='favorite_recipe_user_idx'
+            ),
+            models.Index(fields=['created'], name='favorite_created_idx'),
+        ]
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
 
@@ -171,6 +244,10 @@ class ShoppingList(models.Model):
         related_name='shoppinglist_recipe',
         verbose_name='Рецепт',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления',
+    )
 
     class Meta:
         constraints = [
@@ -178,5 +255,243 @@ class ShoppingList(models.Model):
                 fields=['user', 'recipe'],
                 name='unique_user_shoppinglist')
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'],
+                name='shoppinglist_recipe_user_idx'
+            ),
+            models.Index(fields=['created'], name='shoppinglist_created_idx'),
+        ]
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+
+
+class FeedItem(models.Model):
+    """Рецепт автора из подписок во входящей ленте пользователя.
+
+    Дата публикации копируется из рецепта, чтобы страница ленты читалась
+    по индексу входящих без соединения с рецептами.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации рецепта',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_feed_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feeditem_user_pub_date_idx'
+            ),
+        ]
+        verbose_name = 'Рецепт в ленте подписок'
+        verbose_name_plural = 'Лента подписок'
+
+    def __str__(self):
+        return f'{self.user_id} {self.recipe_id}'
+
+
+class ShoppingCartItemManager(models.Manager):
+    """Инкрементальное обновление итогов списков покупок"""
+
+    @staticmethod
+    def recipe_amounts(*recipes):
+        """Количество каждого ингредиента рецептов {ingredient_id: amount}"""
+        return dict(
+            RecipeIngredient.objects.filter(
+                recipe__in=recipes
+            ).values_list('ingredient_id').annotate(
+                total=Sum('amount')
+            ).order_by()
+        )
+
+    def change_totals(self, user_ids, deltas):
+        """Прибавляет deltas {ingredient_id: amount} к итогам пользователей.
+
+        Недостающие строки создаются с нулем, затем все итоги меняются одним
+        UPDATE, строки с неположительным итогом удаляются.
+        """
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=0
+                )
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items() if delta > 0
+            ],
+            ignore_conflicts=True
+        )
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+        items.update(total_amount=F('total_amount') + Case(
+            *[
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ],
+            default=Value(0),
+            output_field=models.IntegerField()
+        ))
+        items.filter(total_amount__lte=0).delete()
+
+    def add_recipe(self, user, *recipes):
+        """Учет рецептов, добавленных в список покупок"""
+        if recipes:
+            self.change_totals([user.id], self.recipe_amounts(*recipes))
+
+    def remove_recipe(self, user, *recipes):
+        """Учет рецептов, удаленных из списка покупок"""
+        if recipes:
+            self.change_totals([user.id], {
+                ingredient_id: -amount
+                for ingredient_id, amount
+                in self.recipe_amounts(*recipes).items()
+            })
+
+    def change_recipe(self, recipe, deltas):
+        """Учет изменения ингредиентов рецепта во всех списках покупок"""
+        if not any(deltas.values()):
+            return
+        self.change_totals(
+            list(ShoppingList.objects.filter(
+                recipe=recipe
+            ).values_list('user_id', flat=True)),
+            deltas
+        )
+
+
+class ShoppingCartItem(models.Model):
+    """Модель итогов списка покупок пользователя по ингредиентам"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_items',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_items',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Общее количество',
+    )
+
+    objects = ShoppingCartItemManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_user_cart_ingredient'
+            )
+        ]
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+
+    def __str__(self):
+        return f'{self.user_id} {self.ingredient_id} {self.total_amount}'
+
+
+class RecipeScore(models.Model):
+    """Предрассчитанная популярность рецепта для сортировки trending.
+
+    Вклад события равен весу, умноженному на 2 ** ((created - epoch) /
+    период полураспада). Общий для всех рецептов множитель затухания не
+    меняет порядок, поэтому новые события просто добавляются к сумме.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Популярность',
+        default=0,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-score', '-recipe'],
+                name='recipescore_rank_idx'
+            ),
+        ]
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.score}'
+
+
+class TrendingState(models.Model):
+    """Состояние пересчета популярности: точка отсчета и high-water mark"""
+    epoch = models.DateTimeField(
+        verbose_name='Точка отсчета весов',
+    )
+    high_water = models.DateTimeField(
+        verbose_name='События учтены до',
+    )
+
+    class Meta:
+        verbose_name = 'Состояние пересчета популярности'
+        verbose_name_plural = 'Состояние пересчета популярности'
+
+    def __str__(self):
+        return f'{self.epoch} {self.high_water}'
+
+
+class MediaFile(models.Model):
+    """Счетчик ссылок рецептов на файл хранилища (фото и его варианты)"""
+    name = models.CharField(
+        verbose_name='Путь в хранилище',
+        max_length=255,
+        unique=True,
+    )
+    refcount = models.PositiveIntegerField(
+        verbose_name='Количество ссылок',
+        default=0,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения счетчика',
+        auto_now=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['refcount', 'updated'],
+                name='mediafile_refcount_idx'
+            ),
+        ]
+        verbose_name = 'Файл хранилища'
+        verbose_name_plural = 'Файлы хранилища'
+
+    def __str__(self):
+        return f'{self.name} {self.refcount}'
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Value,
+    When
+)
+
+from .models import RecipeIngredient
+
+
+def search_recipes(queryset, value):
+    """Рецепты по поисковому запросу в порядке релевантности.
+
+    В PostgreSQL запрос в синтаксисе websearch сравнивается с
+    search_vector по GIN индексу и ранжируется ts_rank: название важнее
+    ингредиентов, ингредиенты важнее описания. Для SQLite каждое слово
+    ищется подстрокой в названии, описании и ингредиентах, выше
+    рецепты с запросом в названии.
+    """
+    value = value.strip()
+    if not value:
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        query = SearchQuery(
+            value, config=settings.SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-id')
+    for word in value.split():
+        queryset = queryset.filter(
+            Q(name__icontains=word)
+            | Q(text__icontains=word)
+            | Q(Exists(RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk'), ingredient__name__icontains=word
+            )))
+        )
+    return queryset.annotate(
+        search_rank=Case(
+            When(name__icontains=value, then=Value(1.0)),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    ).order_by('-search_rank', '-id')
@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_init, post_save
+
+from .autocomplete import ingredient_autocomplete
+from .matching import recipe_matcher
+from .media import release_media, remember_media, track_media
+from .models import Ingredient, Recipe, RecipeIngredient
+
+post_save.connect(
+    ingredient_autocomplete.invalidate,
+    sender=Ingredient,
+    dispatch_uid='ingredient_autocomplete_save',
+)
+post_delete.connect(
+    ingredient_autocomplete.invalidate,
+    sender=Ingredient,
+    dispatch_uid='ingredient_autocomplete_delete',
+)
+post_init.connect(
+    remember_media,
+    sender=Recipe,
+    dispatch_uid='recipe_media_init',
+)
+post_save.connect(
+    track_media,
+    sender=Recipe,
+    dispatch_uid='recipe_media_save',
+)
+post_delete.connect(
+    release_media,
+    sender=Recipe,
+    dispatch_uid='recipe_media_delete',
+)
+post_delete.connect(
+    recipe_matcher.recipe_changed,
+    sender=Recipe,
+    dispatch_uid='recipe_matcher_delete',
+)
+for event, action in ((post_save, 'save'), (post_delete, 'delete')):
+    event.connect(
+        recipe_matcher.recipe_changed,
+        sender=RecipeIngredient,
+        dispatch_uid=f'recipe_ingredient_matcher_{action}',
+    )
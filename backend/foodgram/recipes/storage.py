@@ -0,0 +1,47 @@
+import hashlib
+import os
+from time import time
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def touch(storage, name):
+    """Обновление времени изменения файла, защищает его от сборщика"""
+    now = time()
+    os.utime(storage.path(name), (now, now))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - sha256 его содержимого.
+
+    Одинаковые фото сохраняются один раз: если файл с таким хешем уже
+    есть, запись пропускается и у файла только обновляется время
+    изменения, чтобы сборщик мусора не удалил его до сохранения рецепта.
+    Содержимое файла по имени никогда не меняется, поэтому nginx может
+    отдавать их с Cache-Control immutable.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        name = self.hashed_name(name, digest.hexdigest())
+        if self.exists(name):
+            touch(self, name)
+            return name
+        return super().save(name, content, max_length)
+
+    @staticmethod
+    def hashed_name(name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(
+            directory, digest[:2], f'{digest}{extension}'
+        ).replace('\\', '/')
+
+
+media_storage = ContentAddressedStorage()
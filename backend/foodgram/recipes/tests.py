@@ -0,0 +1,174 @@
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+from unittest import SkipTest
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from .fixtures import seed_ingredients, seed_recipes, seed_users
+from .matching import RecipeMatcher
+from .media import variant_names
+from .models import Ingredient, Recipe, RecipeIngredient
+from .search import search_recipes
+
+
+class HotQueryPlansTest(TestCase):
+    """Горячие запросы не читают большие таблицы полным сканированием"""
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor != 'postgresql':
+            raise SkipTest('EXPLAIN проверяется только на PostgreSQL')
+        super().setUpClass()
+
+    def test_explain_hot_queries(self):
+        call_command('explain_hot_queries', seed=20000, stdout=StringIO())
+
+
+class SearchVectorTest(TestCase):
+    """Триггеры обновляют поисковый документ при изменении рецепта"""
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor != 'postgresql':
+            raise SkipTest('Триггеры поиска есть только в PostgreSQL')
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ingredient_id = seed_ingredients(1, 'свекла')[0]
+        cls.recipe_id = seed_recipes(
+            seed_users(1), 1, [cls.ingredient_id], per_recipe=1
+        )[0]
+
+    def found(self, value):
+        return self.recipe_id in search_recipes(
+            Recipe.objects.all(), value
+        ).values_list('id', flat=True)
+
+    def test_name(self):
+        self.assertFalse(self.found('борщ'))
+        Recipe.objects.filter(pk=self.recipe_id).update(name='Борщ')
+        self.assertTrue(self.found('борщ'))
+
+    def test_text(self):
+        self.assertFalse(self.found('сметаной'))
+        recipe = Recipe.objects.get(pk=self.recipe_id)
+        recipe.text = 'Подавать со сметаной'
+        recipe.save(update_fields=('text',))
+        self.assertTrue(self.found('сметаной'))
+
+    def test_ingredients(self):
+        self.assertTrue(self.found('свекла'))
+        Ingredient.objects.filter(pk=self.ingredient_id).update(
+            name='морковь'
+        )
+        self.assertTrue(self.found('морковь'))
+        RecipeIngredient.objects.filter(recipe_id=self.recipe_id).delete()
+        self.assertFalse(self.found('морковь'))
+
+
+@override_settings(BACKGROUND_TASKS_ASYNC=False)
+class RecipeMatcherTest(TestCase):
+    """Поиск по индексу совпадает с поиском группировкой в БД"""
+
+    queries = (
+        ([0], None),
+        ([0, 1, 2], None),
+        ([0, 1, 2], 0),
+        ([3, 5, 7, 9, 11], 2),
+        (list(range(20)), 1),
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ingredient_ids = seed_ingredients(25)
+        author_ids = seed_users(3)
+        cls.recipe_ids = [
+            recipe_id
+            for per_recipe in (1, 3, 6)
+            for recipe_id in seed_recipes(
+                author_ids, 40, cls.ingredient_ids, per_recipe=per_recipe
+            )
+        ]
+
+    def setUp(self):
+        self.matcher = RecipeMatcher()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.matcher.match([])
+        self.assertTrue(self.matcher._index)
+
+    def assert_matches_db(self):
+        for positions, max_missing in self.queries:
+            ingredient_ids = [
+                self.ingredient_ids[position] for position in positions
+            ]
+            with self.subTest(positions=positions, max_missing=max_missing):
+                matches = self.matcher.match(ingredient_ids, max_missing)
+                self.assertTrue(matches)
+                with self.settings(RECIPE_MATCH_INDEX_ENABLED=False):
+                    self.assertEqual(matches, list(
+                        RecipeMatcher().match(ingredient_ids, max_missing)
+                    ))
+
+    def test_built_index(self):
+        self.assert_matches_db()
+
+    def test_updated_index(self):
+        changed = self.recipe_ids[::7]
+        RecipeIngredient.objects.filter(recipe_id__in=changed[::2]).delete()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=self.ingredient_ids[-1],
+                amount=1,
+            )
+            for recipe_id in changed[1::2]
+        ], ignore_conflicts=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.matcher.mark_dirty(changed)
+        self.assert_matches_db()
+
+
+class BuildImageVariantsTest(TestCase):
+    """Команда build_image_variants пропускает фото, которые не читаются"""
+
+    def setUp(self):
+        media_root = TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        author_ids = seed_users(1)
+        self.missing_id, photo_id = seed_recipes(author_ids, 2)
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), 'orange').save(buffer, 'PNG')
+        self.photo = Recipe.objects.get(pk=photo_id)
+        self.photo.image.save('photo.png', ContentFile(buffer.getvalue()))
+
+    def build(self, *args):
+        stdout = StringIO()
+        with self.assertLogs('recipes.images', 'WARNING') as logs:
+            call_command('build_image_variants', *args, stdout=stdout)
+        self.assertIn(str(self.missing_id), logs.output[0])
+        self.assertIn('Обработано фото: 1, пропущено: 1', stdout.getvalue())
+        self.photo.refresh_from_db()
+        return variant_names(self.photo.image_variants)
+
+    def test_missing_photo(self):
+        self.assertTrue(self.build())
+        self.assertEqual(
+            Recipe.objects.get(pk=self.missing_id).image_variants, {}
+        )
+
+    def test_all_reencodes(self):
+        path = sorted(self.build())[0]
+        default_storage.delete(path)
+        default_storage.save(path, ContentFile(b'broken'))
+        self.assertIn(path, self.build('--all'))
+        with default_storage.open(path) as file:
+            Image.open(file).verify()
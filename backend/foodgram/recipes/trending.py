@@ -0,0 +1,98 @@
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Favorite, Recipe, RecipeScore, ShoppingList, TrendingState
+
+BATCH_SIZE = 1000
+MAX_HALF_LIVES = 500
+
+
+def event_sources():
+    """Таблицы событий популярности и вес одного события"""
+    return (
+        (Favorite, settings.TRENDING_FAVORITE_WEIGHT),
+        (ShoppingList, settings.TRENDING_CART_WEIGHT),
+    )
+
+
+def collect_deltas(epoch, lower, upper):
+    """Прирост популярности рецептов по событиям из (lower, upper]"""
+    half_life = timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+    deltas = defaultdict(float)
+    for model, weight in event_sources():
+        events = model.objects.filter(created__lte=upper)
+        if lower is not None:
+            events = events.filter(created__gt=lower)
+        for recipe_id, created in events.values_list(
+            'recipe_id', 'created'
+        ).iterator(chunk_size=BATCH_SIZE):
+            deltas[recipe_id] += weight * 2 ** ((created - epoch) / half_life)
+    return deltas
+
+
+def apply_deltas(deltas):
+    recipe_ids = iter(deltas)
+    for batch in iter(lambda: list(islice(recipe_ids, BATCH_SIZE)), []):
+        scores = RecipeScore.objects.in_bulk(batch)
+        for recipe_id, score in scores.items():
+            score.score += deltas[recipe_id]
+        RecipeScore.objects.bulk_update(scores.values(), ['score'])
+        RecipeScore.objects.bulk_create(
+            [
+                RecipeScore(recipe_id=recipe_id, score=deltas[recipe_id])
+                for recipe_id in batch if recipe_id not in scores
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def add_missing_recipes():
+    """Нулевая популярность для рецептов без строки в RecipeScore"""
+    recipe_ids = Recipe.objects.filter(
+        score__isnull=True
+    ).values_list('pk', flat=True).iterator(chunk_size=BATCH_SIZE)
+    for batch in iter(lambda: list(islice(recipe_ids, BATCH_SIZE)), []):
+        RecipeScore.objects.bulk_create(
+            [RecipeScore(recipe_id=recipe_id) for recipe_id in batch],
+            ignore_conflicts=True,
+        )
+
+
+@transaction.atomic
+def refresh_trending(full=False):
+    """Пересчет RecipeScore, возвращает количество учтенных рецептов.
+
+    Инкрементальный пересчет добавляет только события после high-water
+    mark. Удаленные из избранного и списков покупок события учитываются
+    только полным пересчетом, он же сдвигает точку отсчета весов, когда
+    множитель становится слишком большим. События, записанные позже
+    TRENDING_REFRESH_LAG секунд назад, ждут следующего запуска, чтобы не
+    пропустить еще не закоммиченные транзакции.
+    """
+    upper = timezone.now() - timedelta(
+        seconds=settings.TRENDING_REFRESH_LAG
+    )
+    half_life = timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+    state = TrendingState.objects.select_for_update().filter(pk=1).first()
+    if state is None:
+        state = TrendingState(pk=1)
+        full = True
+    elif (upper - state.epoch) / half_life > MAX_HALF_LIVES:
+        full = True
+    if full:
+        RecipeScore.objects.all().delete()
+        state.epoch = upper
+        lower = None
+    else:
+        lower = state.high_water
+    deltas = collect_deltas(state.epoch, lower, upper)
+    apply_deltas(deltas)
+    add_missing_recipes()
+    state.high_water = upper
+    state.save()
+    return len(deltas)
@@ -5,7 +5,14 @@ from users.models import User, Follow
 
 class UserAdmin(admin.ModelAdmin):
     """Админка модели User"""
-    list_display = ('email', 'first_name', 'last_name', 'username')
+    list_display = (
+        'email',
+        'first_name',
+        'last_name',
+        'username',
+        'recipes_count',
+        'followers_count',
+    )
     search_fields = ('username', 'email')
     empty_value_display = '-empty-'
 
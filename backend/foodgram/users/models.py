@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.db import models
+from django.db.models.functions import Greatest
 
 
 class User(AbstractUser):
@@ -33,6 +34,21 @@ class User(AbstractUser):
         blank=False,
         null=False
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False,
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписок',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -42,6 +58,18 @@ class User(AbstractUser):
         return self.username
 
 
+def change_counters(queryset, **deltas):
+    """Изменение счетчиков одним UPDATE с F() выражениями.
+
+    Значение не опускается ниже нуля, даже если счетчик разошелся с
+    данными, расхождения исправляет команда reconcile_counters.
+    """
+    return queryset.update(**{
+        field: Greatest(models.F(field) + delta, 0)
+        for field, delta in deltas.items()
+    })
+
+
 class Follow(models.Model):
     """Модель подписок на других пользователей"""
     user = models.ForeignKey(
@@ -68,6 +96,12 @@ class Follow(models.Model):
                 name='check_self_follow'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'
+            ),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 